@@ -0,0 +1,414 @@
+""" ---------------------------------------------------------------------------
+# Load benchmark
+#
+# Seeds a synthetic question bank and drives every endpoint, through the
+# Flask test client or a real threaded WSGI server, reporting latency
+# percentiles, requests per second and database queries per request.
+# From /backend run, for example:
+#
+#   python -m benchmarks.load --questions 100000
+#   python -m benchmarks.load --server --concurrency 8 --requests 2000
+#   python -m benchmarks.load --database postgresql://localhost/trivia_bench
+#   python -m benchmarks.load --database postgresql://localhost/trivia_bench \
+#       --reseed
+#   python -m benchmarks.load --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.load --baseline benchmarks/baseline.json
+#
+# A --database that already holds questions is reused if it holds
+# --questions of them, and otherwise refused unless --reseed is given,
+# since seeding deletes every question.
+#
+# With --baseline, exits with status 1 if an endpoint's p95 latency or
+# queries per request regressed, so it can run in CI.
+# --------------------------------------------------------------------------"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CATEGORIES = ('Science', 'Art', 'Geography', 'History', 'Entertainment',
+              'Sports')
+WORDS = ('river', 'painter', 'planet', 'empire', 'album', 'stadium',
+         'element', 'mountain', 'novel', 'dynasty', 'orbit', 'sculpture')
+SEED_BATCH_SIZE = 10000
+
+""" ---------------------------------------------------------------------------
+# Setup
+# --------------------------------------------------------------------------"""
+
+
+# Stands in for the response cache backend, so cached listings don't hide
+# the cost of the query path.
+class NoCacheBackend:
+    local = False
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+
+def create_bench_app(database_path, use_cache):
+    # The database URL is read by models when it is imported, so the app
+    # is imported after it is set.
+    os.environ['DATABASE_URL'] = database_path
+    from flaskr import create_app
+    test_config = {} if use_cache else {
+        'RESPONSE_CACHE_BACKEND': NoCacheBackend()}
+    return create_app(test_config)
+
+
+def seed(app, question_count, reseed):
+    # Seeds categories and question_count synthetic questions, unless the
+    # database already holds that many. Seeding deletes every question,
+    # so a database holding other questions is refused unless reseed is
+    # set, rather than wiping a database given by mistake.
+    from models import db, Question, Category
+    with app.app_context():
+        existing_count = Question.query.count()
+        if not reseed and existing_count == question_count:
+            return
+        if not reseed and existing_count:
+            raise SystemExit(
+                'the database holds {} questions, seeding would delete '
+                'them; pass --reseed to replace them'.format(existing_count))
+        Question.query.delete()
+        if Category.query.count() == 0:
+            for category_type in CATEGORIES:
+                db.session.add(Category(category_type))
+        db.session.commit()
+        category_ids = [category.id for category in Category.query]
+        random.seed(question_count)
+        for start in range(0, question_count, SEED_BATCH_SIZE):
+            db.session.execute(Question.__table__.insert(), [{
+                'question': 'Which {} is number {}?'.format(
+                    random.choice(WORDS), number),
+                'answer': '{} {}'.format(random.choice(WORDS).title(),
+                                         number),
+                'category': random.choice(category_ids),
+                'difficulty': random.randint(1, 5)
+            } for number in range(start,
+                                  min(start + SEED_BATCH_SIZE,
+                                      question_count))])
+            db.session.commit()
+        # Core inserts skip the ORM events that keep category stats and
+        # the quiz question index.
+        from stats import rebuild_category_stats
+        rebuild_category_stats()
+        from question_index import question_index
+        question_index.invalidate()
+        from versioning import content_version
+        content_version.bump()
+        # Rebuilds the search index over the seeded questions.
+        from search import setup_search
+        setup_search(db.engine)
+
+
+def count_queries(app):
+    # Counts statements sent to the database, across every thread.
+    from sqlalchemy import event
+    from models import db
+    counter = {'queries': 0}
+    lock = threading.Lock()
+
+    def before_cursor_execute(*args):
+        with lock:
+            counter['queries'] += 1
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+    return counter
+
+
+""" ---------------------------------------------------------------------------
+# Scenarios
+# --------------------------------------------------------------------------"""
+
+
+# Builds (method, path, body) requests for each endpoint. Requests are
+# randomized over pages, categories and search terms, so caches only help
+# as much as they would with real traffic.
+class Scenarios:
+    def __init__(self, app):
+        from models import Question, Category
+        with app.app_context():
+            self.question_ids = [row.id for row in
+                                 Question.query.with_entities(Question.id)]
+            self.category_ids = [category.id for category in Category.query]
+        from config import QUESTIONS_PER_PAGE
+        self.pages = max(len(self.question_ids) // QUESTIONS_PER_PAGE, 1)
+        self.created_ids = []
+        self.lock = threading.Lock()
+
+    def names(self):
+        return ['categories', 'category_stats', 'questions_page',
+                'questions_cursor', 'category_page', 'search', 'quiz',
+                'quiz_batch', 'create', 'delete']
+
+    def request(self, name):
+        return getattr(self, name)()
+
+    def categories(self):
+        return 'GET', '/api/categories', None
+
+    def category_stats(self):
+        return 'GET', '/api/categories/stats', None
+
+    def questions_page(self):
+        return 'GET', '/api/questions?page={}'.format(
+            random.randint(1, self.pages)), None
+
+    def questions_cursor(self):
+        from responses import encode_cursor
+        return 'GET', '/api/questions?after={}'.format(
+            encode_cursor(random.choice(self.question_ids))), None
+
+    def category_page(self):
+        return 'GET', '/api/categories/{}/questions?page={}'.format(
+            random.choice(self.category_ids),
+            random.randint(1, max(self.pages // len(self.category_ids),
+                                  1))), None
+
+    def search(self):
+        return 'POST', '/api/questions', {
+            'search_term': random.choice(WORDS)}
+
+    def quiz(self):
+        return 'POST', '/api/quizzes', {
+            'previous_questions': random.sample(
+                self.question_ids, min(10, len(self.question_ids))),
+            'quiz_category': random.choice([0] + self.category_ids)}
+
+    def quiz_batch(self):
+        return 'POST', '/api/quizzes/batch', {
+            'previous_questions': random.sample(
+                self.question_ids, min(10, len(self.question_ids))),
+            'quiz_category': random.choice([0] + self.category_ids),
+            'count': 10}
+
+    def create(self):
+        return 'POST', '/api/questions', {
+            'question': 'Which {} is new?'.format(random.choice(WORDS)),
+            'answer': random.choice(WORDS).title(),
+            'difficulty': random.randint(1, 5),
+            'category': random.choice(self.category_ids)}
+
+    def delete(self):
+        with self.lock:
+            question_id = (self.created_ids.pop() if self.created_ids
+                           else 0)
+        return 'DELETE', '/api/questions/{}'.format(question_id), None
+
+    def record(self, name, data):
+        # Keeps created ids so the delete scenario removes them.
+        if name == 'create' and data and data.get('created'):
+            with self.lock:
+                self.created_ids.append(data['created'])
+
+
+""" ---------------------------------------------------------------------------
+# Clients
+# --------------------------------------------------------------------------"""
+
+
+def test_client_send(app):
+    client = app.test_client()
+
+    def send(method, path, body):
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+    return send
+
+
+def server_send(base_url):
+    def send(method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            base_url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as error:
+            return error.code, None
+    return send
+
+
+def start_server(app):
+    # Serves the app on a threaded WSGI server on a free local port.
+    from werkzeug.serving import make_server
+    # Request logging would dominate the timings.
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+""" ---------------------------------------------------------------------------
+# Benchmark
+# --------------------------------------------------------------------------"""
+
+
+def percentile(latencies, percent):
+    # Nearest-rank percentile of sorted latencies.
+    index = max(int(round(percent / 100 * len(latencies))) - 1, 0)
+    return latencies[index]
+
+
+def run_scenario(name, scenarios, send, counter, requests, concurrency):
+    # Sends requests for one scenario and summarizes the results.
+    def timed_request(number):
+        method, path, body = scenarios.request(name)
+        start = time.perf_counter()
+        status_code, data = send(method, path, body)
+        latency = (time.perf_counter() - start) * 1000
+        scenarios.record(name, data)
+        return latency, status_code
+
+    queries_before = counter['queries']
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(timed_request, range(requests)))
+    else:
+        results = [timed_request(number) for number in range(requests)]
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, status_code in results)
+    return {
+        'requests': requests,
+        'errors': sum(1 for latency, status_code in results
+                      if status_code >= 500),
+        'p50': round(percentile(latencies, 50), 3),
+        'p95': round(percentile(latencies, 95), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'mean': round(statistics.mean(latencies), 3),
+        'rps': round(requests / elapsed, 1),
+        'queries': round((counter['queries'] - queries_before) / requests,
+                         2)
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Returns regressions of p95 latency beyond the tolerance, or of
+    # queries per request, against the baseline.
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95'] > before['p95'] * (1 + tolerance):
+            regressions.append('{}: p95 {:.2f} ms, baseline {:.2f} ms'
+                               .format(name, result['p95'], before['p95']))
+        if result['queries'] > before['queries']:
+            regressions.append('{}: {} queries per request, baseline {}'
+                               .format(name, result['queries'],
+                                       before['queries']))
+    return regressions
+
+
+def report(results, baseline):
+    print('{:<18} {:>9} {:>9} {:>9} {:>9} {:>8} {:>7} {:>7}'.format(
+        'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'rps', 'queries',
+        'errors', 'p95 Δ'))
+    for name, result in results.items():
+        before = baseline.get(name)
+        change = ('{:+.0%}'.format(result['p95'] / before['p95'] - 1)
+                  if before and before['p95'] else '')
+        print('{:<18} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>8} {:>7} '
+              '{:>7}'.format(name, result['p50'], result['p95'],
+                             result['p99'], result['rps'],
+                             result['queries'], result['errors'], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('#')[1])
+    parser.add_argument('--questions', type=int, default=10000,
+                        help='synthetic questions to seed (default 10000)')
+    parser.add_argument('--database',
+                        help='database URL (default a temporary SQLite '
+                             'file)')
+    parser.add_argument('--reseed', action='store_true',
+                        help='delete every question in the database and '
+                             'reseed, even if the question count matches')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per endpoint (default 500)')
+    parser.add_argument('--server', action='store_true',
+                        help='drive a threaded WSGI server over HTTP '
+                             'instead of the test client')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='concurrent clients with --server')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='disable the response cache')
+    parser.add_argument('--endpoints', nargs='*',
+                        help='endpoints to run (default all)')
+    parser.add_argument('--baseline',
+                        help='JSON baseline to compare against')
+    parser.add_argument('--save-baseline',
+                        help='write results as a JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 regression (default 0.2)')
+    args = parser.parse_args(argv)
+
+    temporary_file = None
+    database_path = args.database
+    if database_path is None:
+        temporary_file = tempfile.NamedTemporaryFile(suffix='.db',
+                                                     delete=False)
+        temporary_file.close()
+        database_path = 'sqlite:///' + temporary_file.name
+    try:
+        app = create_bench_app(database_path, not args.no_cache)
+        seed(app, args.questions, args.reseed)
+        counter = count_queries(app)
+        scenarios = Scenarios(app)
+        server = None
+        concurrency = 1
+        if args.server:
+            server, base_url = start_server(app)
+            send = server_send(base_url)
+            concurrency = args.concurrency
+        else:
+            send = test_client_send(app)
+
+        print('{} questions, {}, {} requests per endpoint{}'.format(
+            len(scenarios.question_ids),
+            'WSGI server, {} clients'.format(concurrency) if server
+            else 'test client', args.requests,
+            ', no response cache' if args.no_cache else ''))
+        results = {}
+        for name in args.endpoints or scenarios.names():
+            results[name] = run_scenario(name, scenarios, send, counter,
+                                         args.requests, concurrency)
+        if server is not None:
+            server.shutdown()
+    finally:
+        if temporary_file is not None:
+            os.remove(temporary_file.name)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    report(results, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('regression: ' + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
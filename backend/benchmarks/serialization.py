@@ -0,0 +1,97 @@
+""" ---------------------------------------------------------------------------
+# Serialization benchmark
+#
+# Compares building a question listing from ORM objects with format() and
+# jsonify, against column rows serialized with compact json.dumps and,
+# when it is installed, orjson. From /backend run:
+#
+#   python -m benchmarks.serialization [sizes ...]
+# --------------------------------------------------------------------------"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from flask import Flask, jsonify
+from models import setup_db, db, Question, Category
+from serializers import question_rows, format_rows, orjson
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+REPEAT = 5
+
+
+def seed(count):
+    # Replaces the questions with count generated questions.
+    Question.query.delete()
+    if Category.query.count() == 0:
+        db.session.add(Category('Science'))
+    db.session.commit()
+    category_id = Category.query.first().id
+    db.session.bulk_insert_mappings(Question, [{
+        'question': f'Benchmark question number {number}?',
+        'answer': f'Benchmark answer {number}',
+        'category': category_id,
+        'difficulty': number % 5 + 1
+    } for number in range(count)])
+    db.session.commit()
+
+
+def orm_jsonify():
+    # The previous path: ORM objects, format() per row and jsonify.
+    questions = [question.format() for question
+                 in Question.query.order_by(Question.id)]
+    return jsonify({'success': True, 'questions': questions}).get_data()
+
+
+def rows_json():
+    # The serializer path without orjson: column tuples and compact
+    # json.dumps.
+    questions = format_rows(question_rows(
+        Question.query.order_by(Question.id)))
+    return json.dumps({'success': True, 'questions': questions},
+                      separators=(',', ':')).encode()
+
+
+def rows_orjson():
+    # The serializer path with orjson: column tuples and orjson.dumps.
+    questions = format_rows(question_rows(
+        Question.query.order_by(Question.id)))
+    return orjson.dumps({'success': True, 'questions': questions},
+                        option=orjson.OPT_NON_STR_KEYS)
+
+
+def best_time(function):
+    # Returns the fastest of several runs, in milliseconds.
+    times = []
+    for run in range(REPEAT):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def main(sizes):
+    database_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database_file.close()
+    app = Flask(__name__)
+    setup_db(app, f'sqlite:///{database_file.name}')
+    print(f'{"questions":>10} {"jsonify ms":>12} {"json ms":>10} '
+          f'{"orjson ms":>10}')
+    try:
+        with app.app_context():
+            for size in sizes:
+                seed(size)
+                jsonify_time = best_time(orm_jsonify)
+                json_time = best_time(rows_json)
+                # orjson is optional, and timed only when installed.
+                orjson_time = (f'{best_time(rows_orjson):>10.1f}'
+                               if orjson is not None else f'{"-":>10}')
+                print(f'{size:>10} {jsonify_time:>12.1f} {json_time:>10.1f} '
+                      f'{orjson_time}')
+    finally:
+        os.remove(database_file.name)
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,289 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import random
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, object_session
+from models import Question, Category
+from versioning import content_version
+from config import (CATEGORY_CACHE_TTL, RESPONSE_CACHE_SIZE,
+                    RESPONSE_CACHE_TTL)
+
+""" ---------------------------------------------------------------------------
+# Category Cache
+# --------------------------------------------------------------------------"""
+
+
+# Holds the category map in memory so requests don't query categories.
+# Entries expire after a TTL, and are invalidated when categories change
+# through the ORM.
+class CategoryCache:
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.categories = None
+        self.expires = 0
+        self.lock = Lock()
+
+    def get(self):
+        # Returns the cached category map, loading it if expired.
+        categories = self.categories
+        if categories is not None and time.monotonic() < self.expires:
+            return categories
+        with self.lock:
+            if (self.categories is None or
+                    time.monotonic() >= self.expires):
+                categories = self.load()
+                # Empty results aren't cached, so categories added
+                # directly to the database show up on the next request.
+                if categories:
+                    self.categories = categories
+                    self.expires = time.monotonic() + self.ttl
+                return categories
+            return self.categories
+
+    def load(self):
+        # Gets all categories from the database as {id: type}.
+        query = Category.query.order_by(Category.type).all()
+        return {category.id: category.type for category in query}
+
+    def exists(self, category_id):
+        # Checks if category exists without a database query.
+        return category_id in self.get()
+
+    def invalidate(self):
+        # Drops the cached map so the next request reloads it.
+        with self.lock:
+            self.categories = None
+            self.expires = 0
+
+
+category_cache = CategoryCache()
+
+""" ---------------------------------------------------------------------------
+# Response Cache Backends
+# --------------------------------------------------------------------------"""
+
+
+# Holds cached responses in process memory, evicting the least recently
+# used. Entries set without a TTL, which the response cache uses for tag
+# generations, are kept apart so they are never evicted.
+class LRUBackend:
+    local = True
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pinned = {}
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.pinned:
+                return self.pinned[key]
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if time.monotonic() >= expires:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            if ttl is None:
+                self.pinned[key] = value
+                return
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+# Holds cached responses in a store shared by every process, through a
+# client with the get(name) and set(name, value, ex=seconds) methods of
+# redis-py, for example redis.Redis(). Use this when running more than
+# one worker, so invalidations reach every worker.
+class SharedBackend:
+    local = False
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+
+# Stands in for a redis-py client in tests, keeping values in memory.
+class MemoryClient:
+    def __init__(self):
+        self.values = {}
+        self.lock = Lock()
+
+    def get(self, name):
+        with self.lock:
+            value, expires = self.values.get(name, (None, None))
+            if expires is not None and time.monotonic() >= expires:
+                del self.values[name]
+                return None
+            return value
+
+    def set(self, name, value, ex=None):
+        with self.lock:
+            expires = time.monotonic() + ex if ex is not None else None
+            self.values[name] = (value.encode() if type(value) == str
+                                 else value, expires)
+
+
+""" ---------------------------------------------------------------------------
+# Response Cache
+# --------------------------------------------------------------------------"""
+
+
+# Caches serialized 200 responses of question listings, keyed by route,
+# page and cursor. Each view is tagged, for example by its category, and
+# every tag has a generation that is part of the key. Invalidating a tag
+# changes its generation, so only responses with that tag miss, and old
+# entries age out of the backend.
+#
+# The backend is app.config['RESPONSE_CACHE_BACKEND'], set by create_app,
+# an LRUBackend by default or a SharedBackend for more than one process.
+class ResponseCache:
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    def cached(self, tags):
+        # Decorates a view to serve GET responses from the cache. Tags is
+        # a function of the view arguments returning the view's tags.
+        def decorator(view):
+            @wraps(view)
+            def cached_view(*args, **kwargs):
+                if request.method != 'GET':
+                    return view(*args, **kwargs)
+                key = self.key(tags(**kwargs))
+                body = self.backend.get(key)
+                if body is not None:
+                    return current_app.response_class(
+                        body, mimetype='application/json')
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    self.backend.set(key, response.get_data(), self.ttl)
+                return response
+            return cached_view
+        return decorator
+
+    def key(self, tags):
+        # Builds the key from the route, pagination arguments and the
+        # current generation of each tag. Generations in a local backend
+        # only change with this process's writes, so its keys also
+        # include the content version, which changes with every worker's.
+        generations = ','.join(f'{tag}@{self.generation(tag)}'
+                               for tag in sorted(tags))
+        if self.backend.local:
+            generations += ':' + (g.content_version if 'content_version' in g
+                                  else content_version.current())
+        return 'response:{}?page={}&after={}:{}'.format(
+            request.path, request.args.get('page'),
+            request.args.get('after'), generations)
+
+    def generation(self, tag):
+        # Returns the generation of a tag. Generations start random,
+        # rather than at zero, so a generation lost from a shared store
+        # can't match entries cached before it was lost.
+        generation = self.backend.get(f'generation:{tag}')
+        if generation is None:
+            generation = self.new_generation(tag)
+        return (generation.decode() if type(generation) == bytes
+                else generation)
+
+    def new_generation(self, tag):
+        generation = str(random.getrandbits(63))
+        self.backend.set(f'generation:{tag}', generation)
+        return generation
+
+    def invalidate(self, *tags):
+        # Invalidates every cached response with any of the tags.
+        for tag in tags:
+            self.new_generation(tag)
+
+    def invalidate_questions(self, *category_ids):
+        # Invalidates the question listing and listings of the categories
+        # of questions that were added or deleted.
+        self.invalidate('questions', *{f'category:{category_id}'
+                                       for category_id in category_ids})
+
+
+response_cache = ResponseCache(LRUBackend())
+
+""" ---------------------------------------------------------------------------
+# Invalidation Hooks
+# --------------------------------------------------------------------------"""
+
+
+# Marks the session when categories change, and invalidates straight away
+# so the writing request reads its own change.
+def category_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['categories_changed'] = True
+    category_cache.invalidate()
+
+
+for change_event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, change_event, category_changed)
+
+
+# Records the categories of questions that change in the session, so
+# their listings are invalidated after commit.
+def question_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    categories = session.info.setdefault('question_categories', set())
+    categories.add(target.category)
+    # Questions moved to another category change both listings.
+    categories.update(inspect(target).attrs.category.history.deleted)
+
+
+for change_event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Question, change_event, question_changed)
+
+
+# Invalidates again after commit, in case another request reloaded the
+# map between the flush and the commit, and changes the content version.
+@event.listens_for(Session, 'after_commit')
+def categories_committed(session):
+    if session.info.pop('categories_changed', False):
+        category_cache.invalidate()
+        content_version.bump()
+        # Listings include categories, so are invalidated with them.
+        response_cache.invalidate('categories')
+
+
+# Invalidates listings of questions changed in the commit. Invalidating
+# after commit means any response cached under the new generations was
+# built from committed data.
+@event.listens_for(Session, 'after_commit')
+def questions_committed(session):
+    categories = session.info.pop('question_categories', None)
+    if categories:
+        response_cache.invalidate_questions(*categories)
+
+
+@event.listens_for(Session, 'after_rollback')
+def categories_rolled_back(session):
+    session.info.pop('question_categories', None)
+    if session.info.pop('categories_changed', False):
+        category_cache.invalidate()
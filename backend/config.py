@@ -2,13 +2,99 @@
 # Config
 # --------------------------------------------------------------------------"""
 
+import os
+import tempfile
+
+# Database connection pool. Each process holds up to DB_POOL_SIZE +
+# DB_MAX_OVERFLOW connections, so size these against the database
+# connection limit divided by the number of workers.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# Seconds to wait for a connection before raising an error.
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+# Seconds before a connection is replaced, -1 to never replace.
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# Tests connections before use, to recover from database restarts.
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true') == 'true'
+# Read replicas, see routing.py. Seconds between health checks of a
+# replica, seconds a failed replica is skipped, and seconds after a write
+# by any process sharing the content version during which reads go to
+# the primary.
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL',
+                                                 5))
+DB_REPLICA_RETRY = float(os.environ.get('DB_REPLICA_RETRY', 30))
+DB_REPLICA_LAG_GRACE = float(os.environ.get('DB_REPLICA_LAG_GRACE', 1))
+# Adds a Server-Timing header with the database time and query count of
+# each request, as in debug mode, see instrumentation.py.
+SQL_SERVER_TIMING = os.environ.get('SQL_SERVER_TIMING', 'false') == 'true'
+
 # App config
 QUESTIONS_PER_PAGE = 10
+# Cache-Control for GET endpoints answered with an ETag. Clients and
+# CDNs may store responses, but revalidate them with If-None-Match.
+CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+# File holding the content version shared by worker processes, see
+# versioning.py. The default is shared by workers on one host. Set it to a
+# path on shared storage when workers run on more than one host, or to an
+# empty string to hold the version in memory.
+CONTENT_VERSION_PATH = os.environ.get(
+    'CONTENT_VERSION_PATH',
+    os.path.join(tempfile.gettempdir(), 'trivia_content_version'))
+# Seconds a content version held in memory is used before it changes,
+# which bounds how long another process can answer 304 for content that
+# has since changed.
+CONTENT_VERSION_TTL = 60
+# File holding the quiz question index, mapped read-only by every worker
+# process instead of each loading its own. See question_index.py.
+QUESTION_INDEX_PATH = os.environ.get('QUESTION_INDEX_PATH')
+# Search terms shorter than this are matched without the search index.
+SEARCH_MIN_INDEXED_LENGTH = 3
+# Seconds categories are held in memory before reloading.
+CATEGORY_CACHE_TTL = 300
+# Most question listing responses cached per process, and seconds each
+# is kept. The TTL bounds how stale a per-process cache can get when
+# another process writes, see cache.py.
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 60
+# Seconds an unused quiz session is kept, and the most sessions kept in
+# memory per process.
+QUIZ_SESSION_TTL = 3600
+QUIZ_SESSION_MAX = 10000
+# Seconds the question index used by quizzes is held before reloading,
+# which bounds how long writes by other processes take to show up, and
+# random picks tried before scanning for an unasked question.
+QUESTION_INDEX_TTL = 300
+QUIZ_SAMPLE_ATTEMPTS = 8
+# Most previous_questions items, ids or ranges, a quiz request can send,
+# and the most bytes a quiz request body can have, checked before it is
+# parsed. The default fits PREVIOUS_QUESTIONS_MAX ranges of large ids.
+PREVIOUS_QUESTIONS_MAX = 10000
+QUIZ_REQUEST_MAX_BYTES = int(os.environ.get('QUIZ_REQUEST_MAX_BYTES',
+                                            256 * 1024))
+# Questions returned by a quiz batch by default, and the most a batch can
+# request.
+QUIZ_BATCH_SIZE = 10
+QUIZ_BATCH_MAX = 50
+# Difficulty of the first question of an adaptive quiz.
+ADAPTIVE_START_DIFFICULTY = 1
+# Questions inserted per transaction by bulk imports, and the most row
+# errors listed in an import response.
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 100
+# Questions fetched from the database and written per chunk by exports.
+EXPORT_CHUNK_SIZE = 1000
+# Requests making more queries than this are logged as a warning.
+SQL_QUERIES_WARN = 10
+# Upper bounds, in seconds, of the request latency histogram buckets.
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                           0.25, 0.5, 1, 2.5, 5, 10)
 
 # Error messages
 ERROR_400 = 'bad request'
 ERROR_404 = 'resource not found'
 ERROR_405 = 'method not allowed'
+ERROR_411 = 'length required'
+ERROR_413 = 'request entity too large'
 ERROR_422 = 'request unprocessable'
 ERROR_500 = 'internal server error'
 
@@ -22,10 +108,35 @@ CATEGORY_INT_ERR = ('invalid input, {category_id} in /api/categories/'
                     '{category_id}/questions must be a positive integer')
 PAGE_INT_ERR = ('invalid input, {page_num} in /api/questions/?page={page_num},'
                 ' must be a positive integer')
+CURSOR_ERR = ('invalid input, {cursor} in /api/questions/?after={cursor} '
+              'must be a cursor returned as next_cursor')
+RANKED_CURSOR_ERR = ('invalid input, search results are ranked and can only '
+                     'be paginated with ?page=')
+IMPORT_FORMAT_ERR = ('invalid input, imports must be a JSON array '
+                     '(application/json), NDJSON (application/x-ndjson) or '
+                     'CSV (text/csv)')
+IMPORT_ENCODING_ERR = 'invalid input, row is not valid UTF-8 text'
 QUESTION_FIELDS_ERR = ('invalid input, a new question needs all fields: '
                        'question, answer, difficulty, category')
 PREVIOUS_LIST_ERR = ('invalid input, previous_questions must be an empty '
-                     'list or a list of integers')
+                     'list or a list of integers and [first, last] ranges')
+METRICS_UNAVAILABLE = ('metrics need prometheus_client, install it with '
+                       'pip install prometheus_client')
+SEARCH_TERM_ERR = 'invalid input, search_term must be a string or number'
+QUIZ_MODE_ERR = 'invalid input, mode must be "adaptive"'
+QUIZ_DIFFICULTY_ERR = ('invalid input, difficulty must be an integer from '
+                       '1 to 5')
+QUIZ_ANSWER_ERR = 'invalid input, last_answer_correct must be true or false'
+PREVIOUS_LIMIT_ERR = ('invalid input, previous_questions can have at most '
+                      '{} items, send [first, last] ranges for long quizzes'
+                      .format(PREVIOUS_QUESTIONS_MAX))
+QUIZ_REQUEST_SIZE_ERR = ('quiz requests can be at most {} bytes, send '
+                         '[first, last] ranges in previous_questions for '
+                         'long quizzes')
+QUIZ_REQUEST_LENGTH_ERR = 'quiz requests need a Content-Length header'
+QUIZ_BATCH_COUNT_ERR = ('invalid input, count must be an integer from 1 to '
+                        '{}'.format(QUIZ_BATCH_MAX))
+QUIZ_SESSION_NOT_FOUND = 'quiz session not found or expired'
 QUIZ_CATEGORY_ERR = ('invalid input, quiz_category must be zero or a '
                      'positive integer')
 ADD_QUESTION_CATEGORY_ERR = ('invalid input, "category" must be an integer '
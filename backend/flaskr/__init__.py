@@ -3,14 +3,26 @@
 # --------------------------------------------------------------------------"""
 
 
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, request, abort, jsonify, g
 from flask_cors import CORS
 from types import SimpleNamespace
-from models import setup_db
+from models import setup_db, db, pool_status, database_path
+from search import setup_search
+from stats import setup_category_stats, rebuild_category_stats
+from question_index import question_index
+from sessions import MemorySessionStore
+from cache import LRUBackend, response_cache
+from versioning import content_version
+from instrumentation import LogSink, setup_instrumentation
+from metrics import setup_metrics, metrics_response
 from config import (ERROR_400, ERROR_404, ERROR_405, ERROR_422, ERROR_500,
-                    INVALID_SYNTAX)
-from responses import (Categories, Questions, DeleteQuestion, PostQuestion,
-                       Quiz, StatusError)
+                    INVALID_SYNTAX, CACHE_CONTROL, SQL_SERVER_TIMING,
+                    QUIZ_REQUEST_MAX_BYTES)
+from responses import (Categories, CategoryStats, Questions, DeleteQuestion,
+                       PostQuestion, ImportQuestions, ExportQuestions, Quiz,
+                       QuizBatch, AdaptiveQuiz, QuizSession, StatusError,
+                       check_content_length)
 
 
 """ ---------------------------------------------------------------------------
@@ -22,10 +34,51 @@ from responses import (Categories, Questions, DeleteQuestion, PostQuestion,
 def create_app(test_config=None):
     # Create and configure the app.
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    # Quiz sessions are stored in memory unless another store is
+    # configured, see sessions.py.
+    app.config.setdefault('QUIZ_SESSION_STORE', MemorySessionStore())
+    # Question listings are cached in memory unless a shared backend is
+    # configured, see cache.py.
+    app.config.setdefault('RESPONSE_CACHE_BACKEND', LRUBackend())
+    response_cache.backend = app.config['RESPONSE_CACHE_BACKEND']
+    # Query stats are logged unless another sink is configured, see
+    # instrumentation.py.
+    app.config.setdefault('SQL_METRICS_SINK', LogSink())
+    app.config.setdefault('SQL_SERVER_TIMING', SQL_SERVER_TIMING)
+    app.config.setdefault('QUIZ_REQUEST_MAX_BYTES', QUIZ_REQUEST_MAX_BYTES)
+    # A database set by test_config takes precedence over DATABASE_URL.
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path))
+    setup_search(db.engine)
+    setup_category_stats()
+    question_index.setup()
+    setup_instrumentation(app, db.engine,
+                          *app.extensions['replicas'].engines)
+    setup_metrics(app)
+    # Ends the session used by setup, so the first request on this thread
+    # starts a new one, without setup's replica choice, see routing.py.
+    db.session.remove()
     # Setup CORS. Allow '*' for origins
     CORS(app, resources={r'/api/*': {'origins': '*'}})
 
+    # Endpoints whose GET responses only change when questions or
+    # categories change, so they can be revalidated with an ETag.
+    cacheable_endpoints = {'get_categories', 'get_category_stats',
+                           'get_questions', 'get_questions_by_category'}
+
+    @app.before_request
+    def before_request():
+        # Answers conditional GETs with 304 from the content version,
+        # without touching the database. The version is read before the
+        # response is built, so a write during the request can only
+        # make the ETag older than the response, never newer.
+        if (request.method == 'GET' and
+                request.endpoint in cacheable_endpoints):
+            g.content_version = content_version.current()
+            if request.if_none_match.contains(g.content_version):
+                return app.response_class(status=304)
+
     @app.after_request
     def after_request(response):
         # Setup headers
@@ -33,6 +86,11 @@ def create_app(test_config=None):
                              'Content-Type, Authorization')
         response.headers.add('Access-Control-Allow-Methods',
                              'GET, POST, DELETE, OPTIONS')
+        # Tags cacheable responses with the content version.
+        if ('content_version' in g and
+                response.status_code in (200, 304)):
+            response.set_etag(g.content_version)
+            response.headers['Cache-Control'] = CACHE_CONTROL
         return response
 
 # App routes
@@ -42,9 +100,16 @@ def create_app(test_config=None):
         categories = Categories()
         return categories.response
 
+    @app.route('/api/categories/stats', methods=['GET'])
+    # Provides question counts by category and difficulty.
+    def get_category_stats():
+        category_stats = CategoryStats()
+        return category_stats.response
+
     @app.route('/api/questions', methods=['GET', 'POST'])
     # Handles GET requests to return questions to the view, and POST requests
     # for search terms and adding new questions to the database.
+    @response_cache.cached(lambda: ('questions', 'categories'))
     def get_questions():
         if request.method == 'POST':
             this_request = request.get_json()
@@ -75,6 +140,18 @@ def create_app(test_config=None):
             questions.all()
             return questions.response
 
+    @app.route('/api/questions/import', methods=['POST'])
+    # Imports questions in bulk from a JSON array, NDJSON or CSV.
+    def import_questions():
+        import_questions = ImportQuestions(request)
+        return import_questions.response
+
+    @app.route('/api/questions/export', methods=['GET'])
+    # Streams questions as NDJSON, optionally by category and gzipped.
+    def export_questions():
+        export_questions = ExportQuestions(request)
+        return export_questions.response
+
     @app.route('/api/questions/<int:question_id>', methods=['DELETE'])
     # Deletes a question from the database.
     def delete_question(question_id):
@@ -84,6 +161,8 @@ def create_app(test_config=None):
 
     @app.route('/api/categories/<int:category_id>/questions', methods=['GET'])
     # Gets questions by category id.
+    @response_cache.cached(
+        lambda category_id: (f'category:{category_id}', 'categories'))
     def get_questions_by_category(category_id):
         questions = Questions(category_id=category_id)
         questions.by_category()
@@ -92,14 +171,26 @@ def create_app(test_config=None):
     @app.route('/api/quizzes', methods=['POST'])
     # Launches quiz game based on user selection.
     def play_quizz():
+        # Checks the size of the body before parsing it, since a long
+        # previous_questions list is only counted once parsed.
+        check_content_length(request, app.config['QUIZ_REQUEST_MAX_BYTES'])
         this_request = request.get_json()
         # Verify POST request isn't empty
         if not this_request:
             abort(400, INVALID_SYNTAX)
         form_data = SimpleNamespace(**this_request)
+        # Check for a quiz session, and start or continue it.
+        if (hasattr(form_data, 'session_id') or
+                getattr(form_data, 'session', False) is True):
+            quiz = QuizSession(form_data=form_data)
+            return quiz.response
+        # Check for a quiz mode, and run an adaptive quiz.
+        elif hasattr(form_data, 'mode'):
+            quiz = AdaptiveQuiz(form_data=form_data)
+            return quiz.response
         # Check for attributes and run quiz, abort if
         # none
-        if (hasattr(form_data, 'quiz_category') or
+        elif (hasattr(form_data, 'quiz_category') or
                 hasattr(form_data, 'previous_questions')):
             quiz = Quiz(form_data=form_data)
             return quiz.response
@@ -107,6 +198,42 @@ def create_app(test_config=None):
         else:
             abort(400, INVALID_SYNTAX)
 
+    @app.route('/api/quizzes/batch', methods=['POST'])
+    # Gets the next questions of a quiz in one request.
+    def play_quizz_batch():
+        # Checks the size of the body before parsing it, since a long
+        # previous_questions list is only counted once parsed.
+        check_content_length(request, app.config['QUIZ_REQUEST_MAX_BYTES'])
+        this_request = request.get_json()
+        # Verify POST request isn't empty
+        if not this_request:
+            abort(400, INVALID_SYNTAX)
+        form_data = SimpleNamespace(**this_request)
+        quiz = QuizBatch(form_data=form_data)
+        return quiz.response
+
+    @app.route('/api/pool', methods=['GET'])
+    # Provides database connection pool statistics for sizing workers.
+    def get_pool_status():
+        return jsonify({
+            'success': True,
+            'pool': pool_status()
+        }), 200
+
+    @app.route('/metrics', methods=['GET'])
+    # Provides request and connection pool metrics for Prometheus.
+    def get_metrics():
+        return metrics_response()
+
+# CLI commands
+
+    @app.cli.command('rebuild-category-stats')
+    # Recounts category stats from the questions table.
+    def rebuild_category_stats_command():
+        rebuild_category_stats()
+        content_version.bump()
+        click.echo('Rebuilt category stats.')
+
 # Error handlers
 
     @app.errorhandler(StatusError)
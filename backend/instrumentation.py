@@ -0,0 +1,122 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import logging
+import time
+from threading import Lock
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from config import SQL_QUERIES_WARN
+
+""" ---------------------------------------------------------------------------
+# Query Stats
+# --------------------------------------------------------------------------"""
+
+
+# Counts and times the SQL statements of one request.
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        if duration >= self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+    def server_timing(self):
+        # Formats the stats as a Server-Timing header, in milliseconds.
+        return ('db;dur={:.3f};desc="{} queries", db-slowest;dur={:.3f}'
+                .format(self.total_time * 1000, self.count,
+                        self.slowest_time * 1000))
+
+
+""" ---------------------------------------------------------------------------
+# Metrics Sinks
+# --------------------------------------------------------------------------"""
+
+
+# Logs the query stats of each request to the 'trivia.sql' logger, at
+# debug level, or as a warning when a request makes more than
+# SQL_QUERIES_WARN queries.
+#
+# Other sinks can be configured with app.config['SQL_METRICS_SINK'], and
+# need one method: record(endpoint, stats), called after each request
+# with the endpoint name and its QueryStats.
+class LogSink:
+    def __init__(self, queries_warn=SQL_QUERIES_WARN):
+        self.queries_warn = queries_warn
+        self.logger = logging.getLogger('trivia.sql')
+
+    def record(self, endpoint, stats):
+        level = (logging.WARNING if stats.count > self.queries_warn
+                 else logging.DEBUG)
+        self.logger.log(level, '%s: %d queries in %.3f ms, slowest %.3f ms: '
+                        '%s', endpoint, stats.count, stats.total_time * 1000,
+                        stats.slowest_time * 1000, stats.slowest_statement)
+
+
+# Keeps the query stats of every request in memory, for tests.
+class MemorySink:
+    def __init__(self):
+        self.records = []
+        self.lock = Lock()
+
+    def record(self, endpoint, stats):
+        with self.lock:
+            self.records.append((endpoint, stats))
+
+
+""" ---------------------------------------------------------------------------
+# Setup
+# --------------------------------------------------------------------------"""
+
+
+def setup_instrumentation(app, *engines):
+    # Records the SQL statements of each request from events of the
+    # engines, the primary and any replicas, and reports them to
+    # app.config['SQL_METRICS_SINK']. Responses get a Server-Timing header
+    # in debug mode or with SQL_SERVER_TIMING.
+    for engine in engines:
+        if not event.contains(engine, 'before_cursor_execute',
+                              before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute',
+                         after_cursor_execute)
+
+    # Registered ahead of the app's other request hooks, so statements
+    # they run are counted.
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+
+    @app.after_request
+    def finish_request(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        if app.debug or app.config['SQL_SERVER_TIMING']:
+            response.headers.add('Server-Timing', stats.server_timing())
+        app.config['SQL_METRICS_SINK'].record(request.endpoint, stats)
+        return response
+
+
+def start_request():
+    g.query_stats = QueryStats()
+
+
+# Statements run outside a request, or before it starts, aren't counted.
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info['query_start'] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    duration = time.perf_counter() - conn.info.pop('query_start')
+    if has_request_context() and 'query_stats' in g:
+        g.query_stats.record(statement, duration)
@@ -0,0 +1,104 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import os
+import time
+from flask import g, request
+from models import pool_status
+from responses import StatusError
+from config import ERROR_404, METRICS_UNAVAILABLE, METRICS_LATENCY_BUCKETS
+
+# prometheus_client is optional, and only needed for /metrics.
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+""" ---------------------------------------------------------------------------
+# Metrics
+# --------------------------------------------------------------------------"""
+
+# Request metrics are labelled by endpoint name rather than path, so
+# question ids in paths don't create a series each. Requests that match
+# no route have the endpoint 'none'.
+#
+# With more than one worker process, set the PROMETHEUS_MULTIPROC_DIR
+# environment variable to an empty directory shared by the workers before
+# they start. Each worker then writes its metrics there, and /metrics
+# returns the sum over all workers, whichever worker serves it. Gauges are
+# summed over live workers only.
+if prometheus_client is not None:
+    REQUESTS = prometheus_client.Counter(
+        'trivia_requests_total', 'Requests by endpoint and status code',
+        ['endpoint', 'method', 'status'])
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        'trivia_request_duration_seconds',
+        'Request latency by endpoint and status code',
+        ['endpoint', 'method', 'status'], buckets=METRICS_LATENCY_BUCKETS)
+    IN_PROGRESS = prometheus_client.Gauge(
+        'trivia_requests_in_progress', 'Requests being served',
+        multiprocess_mode='livesum')
+    # Connection pool statistics from pool_status(), for pools that
+    # report them.
+    POOL_GAUGES = {name: prometheus_client.Gauge(
+        'trivia_db_pool_' + name, description, multiprocess_mode='livesum')
+        for name, description in (
+            ('checked_in', 'Idle connections in the pool'),
+            ('checked_out', 'Connections in use'),
+            ('overflow', 'Connections open beyond the pool size'),
+            ('checkouts', 'Connections checked out since start'),
+            ('timeouts', 'Checkouts that timed out since start'),
+            ('wait_time_total',
+             'Seconds spent waiting for a connection since start'))}
+
+
+def setup_metrics(app):
+    # Records request counts, latency and in-flight requests, and updates
+    # the connection pool gauges after each request.
+    if prometheus_client is None:
+        return
+
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        IN_PROGRESS.inc()
+
+    # Registered ahead of the app's other request hooks, so requests they
+    # answer are measured.
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_start' not in g:
+            return response
+        labels = (request.endpoint or 'none', request.method,
+                  str(response.status_code))
+        REQUESTS.labels(*labels).inc()
+        REQUEST_LATENCY.labels(*labels).observe(
+            time.perf_counter() - g.metrics_start)
+        status = pool_status()
+        for name, gauge in POOL_GAUGES.items():
+            if name in status:
+                gauge.set(status[name])
+        return response
+
+    @app.teardown_request
+    def finish_request(exception):
+        if g.pop('metrics_start', None) is not None:
+            IN_PROGRESS.dec()
+
+
+def metrics_response():
+    # Returns the metrics in the Prometheus text format, summed over every
+    # worker process in multiprocess mode.
+    if prometheus_client is None:
+        raise StatusError(ERROR_404, METRICS_UNAVAILABLE, 404)
+    if (os.environ.get('PROMETHEUS_MULTIPROC_DIR') or
+            os.environ.get('prometheus_multiproc_dir')):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return (prometheus_client.generate_latest(registry), 200,
+            {'Content-Type': prometheus_client.CONTENT_TYPE_LATEST})
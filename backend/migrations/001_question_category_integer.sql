@@ -0,0 +1,33 @@
+--
+-- Converts questions.category from a string to an integer foreign key on
+-- categories.id, and adds an index on (category, id) so category listings
+-- and quizzes use index range scans. Databases restored from trivia.psql
+-- already have the integer column and only gain the index.
+--
+-- Run with: psql trivia < migrations/001_question_category_integer.sql
+--
+
+BEGIN;
+
+-- Clears categories that aren't category ids, so the conversion and
+-- foreign key don't fail on existing rows.
+UPDATE questions SET category = NULL
+    WHERE category::text !~ '^[0-9]+$';
+UPDATE questions SET category = NULL
+    WHERE category::text::integer NOT IN (SELECT id FROM categories);
+
+ALTER TABLE questions
+    ALTER COLUMN category TYPE integer USING category::text::integer;
+
+ALTER TABLE questions DROP CONSTRAINT IF EXISTS category;
+ALTER TABLE questions DROP CONSTRAINT IF EXISTS questions_category_fkey;
+ALTER TABLE questions
+    ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category)
+    REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id
+    ON questions (category, id);
+
+ANALYZE questions;
+
+COMMIT;
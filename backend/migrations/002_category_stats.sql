@@ -0,0 +1,27 @@
+--
+-- Adds the category_stats table, which holds the number of questions of
+-- each difficulty in a category for GET /api/categories/stats, and counts
+-- the existing questions. The API keeps it up to date from then on. It
+-- can be recounted at any time with: flask rebuild-category-stats
+--
+-- Run with: psql trivia < migrations/002_category_stats.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS category_stats (
+    category_id integer NOT NULL REFERENCES categories (id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    difficulty integer NOT NULL,
+    question_count integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (category_id, difficulty)
+);
+
+DELETE FROM category_stats;
+
+INSERT INTO category_stats (category_id, difficulty, question_count)
+    SELECT category, difficulty, count(*) FROM questions
+    WHERE category IS NOT NULL AND difficulty IS NOT NULL
+    GROUP BY category, difficulty;
+
+COMMIT;
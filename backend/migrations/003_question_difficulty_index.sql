@@ -0,0 +1,12 @@
+--
+-- Adds an index on (category, difficulty, id), so adaptive quizzes load
+-- question ids by category and difficulty from the index alone. Databases
+-- restored from trivia.psql already have it.
+--
+-- Run with: psql trivia < migrations/003_question_difficulty_index.sql
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_category_difficulty_id
+    ON questions (category, difficulty, id);
+
+ANALYZE questions;
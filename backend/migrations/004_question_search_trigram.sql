@@ -0,0 +1,21 @@
+--
+-- Adds pg_trgm GIN indexes on questions.question and questions.answer, so
+-- search by ILIKE '%term%' uses index scans. The API detects the indexes
+-- on startup and falls back to a pattern match without them. Databases
+-- restored from trivia.psql need this too.
+--
+-- CREATE EXTENSION needs a user allowed to create extensions. The indexes
+-- are built concurrently, so questions stay writable while they build.
+--
+-- Run with: psql trivia < migrations/004_question_search_trigram.sql
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_question_trgm
+    ON questions USING gin (question gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_answer_trgm
+    ON questions USING gin (answer gin_trgm_ops);
+
+ANALYZE questions;
@@ -1,20 +1,115 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import time
+from threading import Lock
+from sqlalchemy import (Column, String, Integer, ForeignKey, Index,
+                        create_engine)
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
 import json
+from routing import RoutingSQLAlchemy, ReplicaSet
+from versioning import content_version
+from config import (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+                    DB_POOL_RECYCLE, DB_POOL_PRE_PING)
 
 '''
 Configure database, the default is
-    postgres with username and password.
+    postgres with username and password,
+    or the DATABASE_URL environment variable.
 '''
 
 db_user = 'postgres'
 db_passw = 'postgres'
 database_name = 'trivia'
-database_path = ("postgres://{}:{}@{}/{}"
-                 .format(db_user, db_passw, 'localhost:5432', database_name))
+database_path = os.environ.get(
+    'DATABASE_URL',
+    "postgres://{}:{}@{}/{}".format(db_user, db_passw, 'localhost:5432',
+                                    database_name))
+# Read replicas, as comma separated URLs. Reads are spread over them and
+# writes go to database_path, see routing.py.
+replica_paths = [path.strip() for path in
+                 os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                 if path.strip()]
+
+db = RoutingSQLAlchemy()
+
+'''
+InstrumentedQueuePool
+    a connection pool that records how long requests wait to
+    check out a connection, and how often they time out
+'''
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            with self.stats_lock:
+                self.timeouts += 1
+            raise
+        wait_time = time.perf_counter() - start
+        with self.stats_lock:
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+        return connection
+
+
+'''
+pool_options(database_path)
+    engine options for the connection pool, from config.py and
+    the environment. SQLite doesn't use a connection pool.
+'''
+
+
+def pool_options(database_path):
+    if database_path.startswith('sqlite'):
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+
+
+'''
+pool_status()
+    live statistics for the connection pool of the bound app
+'''
+
+
+def pool_status():
+    pool = db.engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0)
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool.stats_lock:
+            status.update({
+                'checkouts': pool.checkouts,
+                'timeouts': pool.timeouts,
+                'wait_time_total': round(pool.wait_time_total, 6),
+                'wait_time_max': round(pool.wait_time_max, 6)
+            })
+    return status
 
-db = SQLAlchemy()
 
 '''
 setup_db(app)
@@ -25,9 +120,24 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Options already set on the app, for example by test_config,
+    # take precedence over the pool defaults.
+    engine_options = pool_options(database_path)
+    # Sends executemany statements, such as bulk imports, in batches
+    # rather than one round trip per row.
+    if database_path.startswith('postgres'):
+        engine_options['use_batch_mode'] = True
+    engine_options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
     db.app = app
     db.init_app(app)
     db.create_all()
+    # Replicas already set on the app, for example by test_config, take
+    # precedence over DATABASE_REPLICA_URLS.
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', replica_paths)
+    app.extensions['replicas'] = ReplicaSet([
+        create_engine(replica_path, **pool_options(replica_path))
+        for replica_path in app.config['SQLALCHEMY_REPLICA_URIS']])
 
 
 '''
@@ -38,11 +148,23 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # Lets category listings and quizzes scan questions in a category
+    # in id order from the index, and the adaptive quiz index load
+    # questions by category and difficulty from an index. Existing
+    # databases are migrated by migrations/001_question_category_integer.sql
+    # and migrations/003_question_difficulty_index.sql.
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty_id', 'category',
+              'difficulty', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id',
+                                          onupdate='CASCADE',
+                                          ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -53,14 +175,22 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        # Flushes to get the id from the insert, and returns it so it
+        # can be read after commit without another query.
+        db.session.flush()
+        question_id = self.id
         db.session.commit()
+        content_version.bump()
+        return question_id
 
     def update(self):
         db.session.commit()
+        content_version.bump()
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        content_version.bump()
 
     def format(self):
         return {
@@ -92,3 +222,22 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+'''
+CategoryStat
+    the number of questions of each difficulty in a category, kept up
+    to date as questions change, see stats.py. Existing databases are
+    migrated by migrations/002_category_stats.sql.
+'''
+
+
+class CategoryStat(db.Model):
+    __tablename__ = 'category_stats'
+
+    category_id = Column(Integer, ForeignKey('categories.id',
+                                             onupdate='CASCADE',
+                                             ondelete='CASCADE'),
+                         primary_key=True)
+    difficulty = Column(Integer, primary_key=True)
+    question_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,374 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import Lock
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models import Question
+from stats import stored_key
+from config import (QUESTION_INDEX_TTL, QUESTION_INDEX_PATH,
+                    QUIZ_SAMPLE_ATTEMPTS)
+
+# fcntl is only available on POSIX systems. Elsewhere, workers sharing a
+# snapshot file may rebuild it at the same time.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+""" ---------------------------------------------------------------------------
+# Index Snapshots
+# --------------------------------------------------------------------------"""
+
+# A snapshot file holds a header (magic, version, build time and number
+# of buckets), an entry per bucket (category id, difficulty, and offset
+# and length in ids), then every bucket's ids as 32 bit integers.
+INDEX_MAGIC = b'TQIX'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('=4sIdI')
+BUCKET_ENTRY = struct.Struct('=iiQQ')
+
+
+def load_buckets():
+    # Reads every question's category, difficulty and id from the
+    # ix_questions_category_difficulty_id index, into compact arrays of
+    # ids by (category_id, difficulty). Questions without a category or
+    # difficulty aren't quizzed.
+    buckets = {}
+    query = (Question.query
+             .with_entities(Question.category, Question.difficulty,
+                            Question.id)
+             .filter(Question.category.isnot(None),
+                     Question.difficulty.isnot(None))
+             .order_by(Question.category, Question.difficulty, Question.id))
+    for category_id, difficulty, question_id in query:
+        buckets.setdefault((category_id, difficulty),
+                           array('i')).append(question_id)
+    return buckets
+
+
+def write_snapshot(path, buckets, built_at):
+    # Writes buckets to a snapshot file, replaced atomically so workers
+    # never map a partly written file.
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(descriptor, 'wb') as snapshot_file:
+        snapshot_file.write(INDEX_HEADER.pack(
+            INDEX_MAGIC, INDEX_VERSION, built_at, len(buckets)))
+        offset = 0
+        for (category_id, difficulty), ids in buckets.items():
+            snapshot_file.write(BUCKET_ENTRY.pack(
+                category_id, difficulty, offset, len(ids)))
+            offset += len(ids)
+        for ids in buckets.values():
+            ids.tofile(snapshot_file)
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path):
+    # Maps a snapshot file read-only, returning its build time and buckets
+    # as views of the mapping. Pages of the file are shared by every
+    # process that maps it, so workers don't each hold a copy of the ids.
+    # Returns None if the file is missing or not a snapshot.
+    try:
+        with open(path, 'rb') as snapshot_file:
+            mapping = mmap.mmap(snapshot_file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapping) < INDEX_HEADER.size:
+        return None
+    magic, version, built_at, bucket_count = INDEX_HEADER.unpack_from(
+        mapping)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        return None
+    entries = [BUCKET_ENTRY.unpack_from(
+        mapping, INDEX_HEADER.size + number * BUCKET_ENTRY.size)
+        for number in range(bucket_count)]
+    data_start = INDEX_HEADER.size + bucket_count * BUCKET_ENTRY.size
+    ids = memoryview(mapping)[data_start:].cast('i')
+    return built_at, {(category_id, difficulty): ids[offset:offset + length]
+                      for category_id, difficulty, offset, length in entries}
+
+
+""" ---------------------------------------------------------------------------
+# Question Index
+# --------------------------------------------------------------------------"""
+
+
+# Holds question ids by category and difficulty, so quizzes pick a random
+# question without scanning the category, and fetch only the chosen
+# question. Ids are held as 4 byte integers, in arrays per process, or
+# when QUESTION_INDEX_PATH is set, in a snapshot file mapped by every
+# worker, which the first worker to start writes.
+#
+# Snapshots are reloaded after a TTL. One worker at a time rebuilds the
+# file from the database, holding a lock on <path>.lock, and workers
+# waiting on the lock map the file it wrote rather than rebuilding it
+# again. Within a process, one thread reloads while the others keep
+# sampling the previous snapshot. Questions added or removed through the
+# ORM since the snapshot was built are held in small per-process
+# overlays, applied after commit. Questions deleted by other processes
+# are dropped when they are picked and not found.
+class QuestionIndex:
+    def __init__(self, ttl=QUESTION_INDEX_TTL, path=QUESTION_INDEX_PATH):
+        self.ttl = ttl
+        self.path = path
+        self.buckets = None
+        self.built_at = 0
+        self.expires = 0
+        # Overlays, {(category_id, difficulty): {question_id: time}} of
+        # questions added and {(key, question_id): time} of questions
+        # removed since the snapshot. A key of None removes a question
+        # from every bucket.
+        self.added = {}
+        self.removed = {}
+        # Set by invalidate, so the snapshot is rebuilt even if fresh, and
+        # counted so a reload started before an invalidation isn't kept.
+        self.rebuild = False
+        self.invalidations = 0
+        # Guards the buckets and overlays, and is only held briefly.
+        # Reloads hold reload_lock instead, so one thread reloads at a
+        # time without blocking quizzes.
+        self.lock = Lock()
+        self.reload_lock = Lock()
+
+    def setup(self):
+        # Writes the snapshot file at startup, unless another worker has
+        # written one within the TTL.
+        if self.path:
+            with self.reload_lock:
+                self.reload()
+
+    def get(self):
+        # Returns {(category_id, difficulty): ids}, reloading if expired.
+        # While one thread reloads, others use the previous buckets, or
+        # wait for the reload if there are none yet.
+        buckets = self.buckets
+        if buckets is not None and time.monotonic() < self.expires:
+            return buckets
+        if not self.reload_lock.acquire(blocking=buckets is None):
+            return buckets
+        try:
+            if self.buckets is None or time.monotonic() >= self.expires:
+                return self.reload()
+            return self.buckets
+        finally:
+            self.reload_lock.release()
+
+    def reload(self):
+        # Loads a snapshot, without holding the lock, then swaps it in and
+        # drops overlay changes the snapshot has. Returns its buckets.
+        # Callers hold reload_lock.
+        with self.lock:
+            rebuild = self.rebuild
+            invalidations = self.invalidations
+        built_at, buckets = self.load_snapshot(rebuild)
+        with self.lock:
+            # An invalidation during the load needs another rebuild.
+            if self.invalidations != invalidations:
+                return buckets
+            self.built_at, self.buckets = built_at, buckets
+            self.rebuild = False
+            self.expires = time.monotonic() + self.ttl
+            for key in list(self.added):
+                self.added[key] = {
+                    question_id: changed_at for question_id, changed_at
+                    in self.added[key].items()
+                    if changed_at >= self.built_at}
+            self.removed = {removed: changed_at for removed, changed_at
+                            in self.removed.items()
+                            if changed_at >= self.built_at}
+        return buckets
+
+    def load_snapshot(self, rebuild):
+        # Returns (build time, buckets) from a fresh snapshot file, or
+        # builds a snapshot from the database. The build time is taken
+        # before the database is read, so overlay changes are only dropped
+        # if the snapshot has them. With rebuild, only a snapshot built
+        # after the call is used.
+        requested_at = time.time()
+        if not self.path:
+            return requested_at, load_buckets()
+        snapshot = read_snapshot(self.path)
+        if not rebuild and self.fresh(snapshot, requested_at):
+            return snapshot
+        with open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another worker may have written the snapshot while this one
+            # waited for the lock.
+            snapshot = read_snapshot(self.path)
+            if snapshot is not None and (
+                    snapshot[0] >= requested_at or
+                    (not rebuild and self.fresh(snapshot, requested_at))):
+                return snapshot
+            built_at = time.time()
+            buckets = load_buckets()
+            write_snapshot(self.path, buckets, built_at)
+            return read_snapshot(self.path) or (built_at, buckets)
+
+    def fresh(self, snapshot, now):
+        return snapshot is not None and now - snapshot[0] < self.ttl
+
+    def sample(self, category_id, difficulty, exclude):
+        # Returns a random question id in a category, or in any category
+        # if category id is 0, of a difficulty, or any difficulty if None,
+        # that isn't in exclude. Returns None if there is none.
+        question_ids = self.sample_many(category_id, difficulty, exclude, 1)
+        return question_ids[0] if question_ids else None
+
+    def sample_many(self, category_id, difficulty, exclude, count):
+        # Returns up to count distinct random question ids, as sample.
+        buckets = self.get()
+        with self.lock:
+            sequences = [(key, ids) for key, ids in buckets.items()
+                         if self.matches(key, category_id, difficulty)]
+            sequences += [(key, sorted(ids)) for key, ids
+                          in self.added.items()
+                          if self.matches(key, category_id, difficulty)]
+            total = sum(len(ids) for key, ids in sequences)
+            if total < 1:
+                return []
+            picked = []
+            picked_ids = set()
+            # Random picks take constant time per bucket until most of
+            # the questions have been asked.
+            for attempt in range(QUIZ_SAMPLE_ATTEMPTS * count):
+                if len(picked) == count:
+                    return picked
+                position = random.randrange(total)
+                for key, ids in sequences:
+                    if position < len(ids):
+                        question_id = ids[position]
+                        break
+                    position -= len(ids)
+                if (question_id not in picked_ids and
+                        self.available(key, question_id, exclude)):
+                    picked.append(question_id)
+                    picked_ids.add(question_id)
+            # Then scans the ids left, skipping ranges of previous
+            # questions. Bucket ids are in id order, as loaded.
+            available = list({question_id for key, ids in sequences
+                              for question_id in outside_ranges(ids, exclude)
+                              if question_id not in picked_ids and
+                              self.available(key, question_id, exclude)})
+            return picked + random.sample(
+                available, min(count - len(picked), len(available)))
+
+    def matches(self, key, category_id, difficulty):
+        return (category_id in (0, key[0]) and
+                difficulty in (None, key[1]))
+
+    def available(self, key, question_id, exclude):
+        return (question_id not in exclude and
+                (key, question_id) not in self.removed and
+                (None, question_id) not in self.removed)
+
+    def has_questions(self, category_id):
+        # Checks if a category, or any category if 0, has questions.
+        buckets = self.get()
+        with self.lock:
+            return any(len(ids) for key, ids in
+                       list(buckets.items()) + list(self.added.items())
+                       if self.matches(key, category_id, None))
+
+    def apply(self, changes):
+        # Applies ('add' or 'remove', category_id, difficulty, question_id)
+        # changes to the overlays.
+        changed_at = time.time()
+        with self.lock:
+            for change, category_id, difficulty, question_id in changes:
+                if category_id is None or difficulty is None:
+                    continue
+                key = (category_id, difficulty)
+                if change == 'add':
+                    self.removed.pop((key, question_id), None)
+                    self.added.setdefault(key, {})[question_id] = changed_at
+                else:
+                    self.added.get(key, {}).pop(question_id, None)
+                    self.removed[(key, question_id)] = changed_at
+
+    def discard(self, question_id):
+        # Drops a question id that was picked but no longer exists.
+        with self.lock:
+            self.removed[(None, question_id)] = time.time()
+
+    def invalidate(self):
+        # Expires the index so the next quiz rebuilds it from the
+        # database. The buckets are kept, so other quizzes sample them
+        # while one thread rebuilds, rather than waiting on the load.
+        with self.lock:
+            self.expires = 0
+            self.rebuild = True
+            self.invalidations += 1
+
+
+# Yields sorted ids outside the ranges of previous questions, given as
+# sorted, merged firsts and lasts, as responses.PreviousQuestions holds
+# them. The ids in each range are skipped by bisecting, so a range such as
+# [1, 1000000000000] costs two searches per bucket rather than a check of
+# every id in it.
+def outside_ranges(ids, exclude):
+    start = 0
+    for first, last in zip(getattr(exclude, 'firsts', ()),
+                           getattr(exclude, 'lasts', ())):
+        end = bisect_left(ids, first, start)
+        yield from ids[start:end]
+        start = bisect_right(ids, last, end)
+    yield from ids[start:]
+
+
+question_index = QuestionIndex()
+
+""" ---------------------------------------------------------------------------
+# Update Hooks
+# --------------------------------------------------------------------------"""
+
+
+# Records changes to questions in the session, and applies them to the
+# index after commit, so quizzes never pick uncommitted questions.
+def record_changes(target, *changes):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('question_index_changes', []).extend(
+            change + (target.id,) for change in changes)
+
+
+@event.listens_for(Question, 'after_insert')
+def question_inserted(mapper, connection, target):
+    record_changes(target, ('add', target.category, target.difficulty))
+
+
+@event.listens_for(Question, 'after_update')
+def question_updated(mapper, connection, target):
+    key = (target.category, target.difficulty)
+    if stored_key(target) != key:
+        record_changes(target, ('remove',) + stored_key(target),
+                       ('add',) + key)
+
+
+@event.listens_for(Question, 'after_delete')
+def question_deleted(mapper, connection, target):
+    record_changes(target, ('remove',) + stored_key(target))
+
+
+@event.listens_for(Session, 'after_commit')
+def questions_committed(session):
+    changes = session.info.pop('question_index_changes', None)
+    if changes:
+        question_index.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def questions_rolled_back(session):
+    session.info.pop('question_index_changes', None)
@@ -2,16 +2,39 @@
 # Imports
 # --------------------------------------------------------------------------"""
 
+import base64
+import csv
+import json
 import random
-from flask import jsonify, request
+import zlib
+from bisect import bisect_right
+from collections import Counter
+from flask import current_app, request, stream_with_context
 from types import SimpleNamespace
-from models import Question, Category
-from config import (QUESTIONS_PER_PAGE, QUESTION_NOT_FOUND,
+from models import db, Question
+from cache import category_cache, response_cache
+from search import search_questions
+from stats import add_question_counts, get_category_stats
+from question_index import question_index
+from routing import use_primary
+from versioning import content_version
+from serializers import (question_rows, format_rows, format_rows_iter,
+                         dumps, json_response)
+from config import (QUESTIONS_PER_PAGE,
+                    IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS, INVALID_SYNTAX,
+                    EXPORT_CHUNK_SIZE, IMPORT_FORMAT_ERR, QUESTION_NOT_FOUND,
                     NO_CATEGORIES_FOUND, NO_QUESTIONS_FOUND, CATEGORY_INT_ERR,
                     QUESTION_FIELDS_ERR, PAGE_INT_ERR, CATEGORY_NOT_FOUND,
                     PREVIOUS_LIST_ERR, QUIZ_CATEGORY_ERR,
                     ADD_QUESTION_CATEGORY_ERR, ADD_QUESTION_DIFFICULTY_ERR,
-                    ERROR_404, ERROR_422, ERROR_500)
+                    CURSOR_ERR, QUIZ_SESSION_NOT_FOUND, QUIZ_MODE_ERR,
+                    QUIZ_DIFFICULTY_ERR, QUIZ_ANSWER_ERR,
+                    QUIZ_BATCH_COUNT_ERR, QUIZ_BATCH_SIZE, QUIZ_BATCH_MAX,
+                    PREVIOUS_QUESTIONS_MAX, PREVIOUS_LIMIT_ERR,
+                    ADAPTIVE_START_DIFFICULTY, SEARCH_TERM_ERR,
+                    RANKED_CURSOR_ERR, QUIZ_REQUEST_SIZE_ERR,
+                    QUIZ_REQUEST_LENGTH_ERR, IMPORT_ENCODING_ERR, ERROR_400,
+                    ERROR_404, ERROR_411, ERROR_413, ERROR_422)
 
 """ ---------------------------------------------------------------------------
 # Error Handling
@@ -36,11 +59,161 @@ def string_to_int(value, description):
     if (type(value)) != int:
         try:
             value = int(value)
-        except ValueError:
+        except (ValueError, TypeError):
             raise StatusError(ERROR_422, description, 422)
     return value
 
 
+# Encode a question id as an opaque pagination cursor.
+def encode_cursor(question_id):
+    token = json.dumps({'id': question_id}).encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+
+# Decode a pagination cursor to a question id, raise 422 error if invalid.
+def decode_cursor(cursor):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        token = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        question_id = token['id']
+    except (ValueError, TypeError, KeyError):
+        raise StatusError(ERROR_422, CURSOR_ERR, 422)
+    if type(question_id) != int or question_id < 0:
+        raise StatusError(ERROR_422, CURSOR_ERR, 422)
+    return question_id
+
+
+# Verify a request body is at most max_bytes before it is read, raise 413
+# error if larger. Bodies streamed without a Content-Length can't be
+# checked before they are read, so raise 411 error for those.
+def check_content_length(request, max_bytes):
+    if request.content_length is None:
+        if request.environ.get('wsgi.input_terminated'):
+            raise StatusError(ERROR_411, QUIZ_REQUEST_LENGTH_ERR, 411)
+    elif request.content_length > max_bytes:
+        raise StatusError(ERROR_413,
+                          QUIZ_REQUEST_SIZE_ERR.format(max_bytes), 413)
+
+
+# Decode lines of a byte stream as UTF-8, without reading the whole
+# stream. Lines that aren't UTF-8 are appended to invalid_lines and
+# replaced with blank lines, which CSV readers skip.
+def decode_lines(stream, invalid_lines):
+    for line in stream:
+        try:
+            yield line.decode('utf-8')
+        except UnicodeDecodeError:
+            invalid_lines.append(line)
+            yield '\n'
+
+
+# Verify quiz form data, converting fields to integers, raise 422 error if
+# invalid.
+def check_quiz_form(form_data):
+    if (not hasattr(form_data, 'quiz_category') or
+            not hasattr(form_data, 'previous_questions')):
+        raise StatusError(ERROR_422, QUIZ_CATEGORY_ERR, 422)
+    # Verifies that category id is an integer and not a negative value.
+    form_data.quiz_category = string_to_int(form_data.quiz_category,
+                                            QUIZ_CATEGORY_ERR)
+    if form_data.quiz_category < 0:
+        raise StatusError(ERROR_422, QUIZ_CATEGORY_ERR, 422)
+    # Verifies that previous questions are passed as a list, of no more
+    # than PREVIOUS_QUESTIONS_MAX integers or [first, last] ranges, and
+    # parses them once.
+    if type(form_data.previous_questions) != list:
+        raise StatusError(ERROR_422, PREVIOUS_LIST_ERR, 422)
+    if len(form_data.previous_questions) > PREVIOUS_QUESTIONS_MAX:
+        raise StatusError(ERROR_422, PREVIOUS_LIMIT_ERR, 422)
+    question_ids = []
+    ranges = []
+    for question in form_data.previous_questions:
+        if type(question) == list:
+            if len(question) != 2:
+                raise StatusError(ERROR_422, PREVIOUS_LIST_ERR, 422)
+            first, last = (string_to_int(question_id, PREVIOUS_LIST_ERR)
+                           for question_id in question)
+            if first > last:
+                raise StatusError(ERROR_422, PREVIOUS_LIST_ERR, 422)
+            ranges.append((first, last))
+        else:
+            question_ids.append(string_to_int(question, PREVIOUS_LIST_ERR))
+    form_data.previous_questions = PreviousQuestions(question_ids, ranges)
+
+
+# Holds the ids of questions already asked in a quiz, as a set of ids and
+# sorted, merged ranges of ids. Long quizzes can send ranges, so the ids
+# don't all have to be sent, parsed and held. Checks ids in O(1), or
+# O(log n) for ranges.
+class PreviousQuestions:
+    def __init__(self, question_ids=(), ranges=()):
+        self.question_ids = set(question_ids)
+        self.firsts = []
+        self.lasts = []
+        for first, last in sorted(ranges):
+            if self.lasts and first <= self.lasts[-1] + 1:
+                self.lasts[-1] = max(self.lasts[-1], last)
+            else:
+                self.firsts.append(first)
+                self.lasts.append(last)
+
+    def __contains__(self, question_id):
+        if question_id in self.question_ids:
+            return True
+        position = bisect_right(self.firsts, question_id) - 1
+        return position >= 0 and question_id <= self.lasts[position]
+
+    def add(self, question_id):
+        self.question_ids.add(question_id)
+
+
+# Pick a random quiz question not in previous questions from the question
+# index, and fetch only that question by id. Ids of questions deleted by
+# another process are dropped from the index and another is picked.
+def pick_question(category_id, difficulty, previous_questions):
+    while True:
+        question_id = question_index.sample(category_id, difficulty,
+                                            previous_questions)
+        if question_id is None:
+            return None
+        this_question = Question.query.get(question_id)
+        if this_question is not None:
+            return this_question
+        question_index.discard(question_id)
+
+
+# Verify new question form data, stripping text and converting fields to
+# integers, raise 422 error if invalid. Categories are the ids of existing
+# categories, passed in so imports look them up once.
+def check_question_form(form_data, categories):
+    # Checks attributes exist.
+    if (not hasattr(form_data, 'question') or
+            not hasattr(form_data, 'answer') or
+            not hasattr(form_data, 'difficulty') or
+            not hasattr(form_data, 'category')):
+        raise StatusError(ERROR_422, QUESTION_FIELDS_ERR, 422)
+    # Checks that question and answer are strings.
+    if (type(form_data.question) != str or
+            type(form_data.answer) != str):
+        raise StatusError(ERROR_422, QUESTION_FIELDS_ERR, 422)
+    # Checks that form data is not empty strings.
+    form_data.question = form_data.question.strip()
+    form_data.answer = form_data.answer.strip()
+    if (form_data.question == '' or form_data.answer == ''
+            or form_data.difficulty == '' or form_data.category == ''):
+        raise StatusError(ERROR_422, QUESTION_FIELDS_ERR, 422)
+    # Verify integer and category exists or error.
+    form_data.category = string_to_int(form_data.category,
+                                       ADD_QUESTION_CATEGORY_ERR)
+    if form_data.category not in categories:
+        raise StatusError(ERROR_422, ADD_QUESTION_CATEGORY_ERR, 422)
+    # Verify integer and in range or error.
+    form_data.difficulty = string_to_int(form_data.difficulty,
+                                         ADD_QUESTION_DIFFICULTY_ERR)
+    if form_data.difficulty < 1 or form_data.difficulty > 5:
+        raise StatusError(ERROR_422, ADD_QUESTION_DIFFICULTY_ERR, 422)
+
+
 """ ---------------------------------------------------------------------------
 # Response Classes
 # --------------------------------------------------------------------------"""
@@ -50,23 +223,46 @@ def string_to_int(value, description):
 class Categories:
     def __init__(self):
         self.data = SimpleNamespace(success=True)
-        query = self.get_all_categories()
-        self.list = {category.id: category.type for category in query}
+        # Categories are served from memory, see cache.py.
+        self.list = self.get_all_categories()
         # Returns 404 if database contains no categories.
         if len(self.list) < 1:
             raise StatusError(ERROR_404, NO_CATEGORIES_FOUND, 404)
         # Structures data and builds response JSON.
         self.data.categories = self.list
-        self.response = jsonify(self.data.__dict__), 200
+        self.response = json_response(self.data.__dict__), 200
 
     def get_all_categories(self):
-        # Get all categories from the database.
-        return Category.query.order_by(Category.type).all()
+        # Get all categories as {id: type} from the category cache.
+        return category_cache.get()
 
     def category_exists(self, category_id):
-        # Checks if category exists.
-        return (Category.query
-                .filter_by(id=category_id).scalar() is not None)
+        # Checks if category exists in the category cache.
+        return category_cache.exists(category_id)
+
+
+# Gets question counts by category and difficulty, from the category
+# stats table rather than the questions, see stats.py.
+class CategoryStats:
+    def __init__(self):
+        self.data = SimpleNamespace(success=True)
+        categories = Categories().list
+        stats = get_category_stats()
+        self.data.categories = []
+        for category_id, category_type in categories.items():
+            # Lists every difficulty a question can have, with zero counts.
+            difficulties = dict.fromkeys(range(1, 6), 0)
+            difficulties.update(stats.get(category_id, {}))
+            self.data.categories.append({
+                'id': category_id,
+                'type': category_type,
+                'total_questions': sum(difficulties.values()),
+                'difficulties': difficulties
+            })
+        # Structures data and builds response JSON.
+        self.data.total_questions = sum(
+            category['total_questions'] for category in self.data.categories)
+        self.response = json_response(self.data.__dict__), 200
 
 
 # Gets questions to pass to views.
@@ -76,7 +272,7 @@ class Questions:
         self.search_term = search_term
         self.category_id = category_id
         self.data = SimpleNamespace(success=True)
-        self.response = jsonify(self.data.__dict__), 200
+        self.response = json_response(self.data.__dict__), 200
 
     def all(self, check_page_length=True):
         # Returns all questions to views.
@@ -89,15 +285,24 @@ class Questions:
             raise StatusError(ERROR_404, NO_QUESTIONS_FOUND, 404)
         # Structures data and builds response JSON.
         self.data.questions = self.questions.list
-        self.data.total_questions = len(self.query)
+        self.data.total_questions = self.questions.total
         self.data.current_category = []
         self.data.categories = self.categories.data.categories
-        self.response = jsonify(self.data.__dict__), 200
+        if self.questions.paginated:
+            self.data.next_cursor = self.questions.next_cursor
+        self.response = json_response(self.data.__dict__), 200
 
     def search(self, check_page_length=False):
         # Returns questions by search query to views.
+
+        # Verifies that the search term is a string, converting numbers
+        # to strings so they are searched as text.
+        if type(self.search_term) in (int, float):
+            self.search_term = str(self.search_term)
+        if type(self.search_term) != str:
+            raise StatusError(ERROR_422, SEARCH_TERM_ERR, 422)
         self.query = self.get_search_questions(self.search_term)
-        self.questions = QuestionsPage(request, self.query)
+        self.questions = QuestionsPage(request, self.query, ranked=True)
         # Unless enabled, does not return a 404 if the list of questions
         # is empty. I believe a search returning an empty list is a
         # better user experience than an error alert.
@@ -105,9 +310,9 @@ class Questions:
             raise StatusError(ERROR_404, NO_QUESTIONS_FOUND, 404)
         # Structures data and builds response JSON.
         self.data.questions = self.questions.list
-        self.data.total_questions = len(self.query)
+        self.data.total_questions = self.questions.total
         self.data.current_category = []
-        self.response = jsonify(self.data.__dict__), 200
+        self.response = json_response(self.data.__dict__), 200
 
     def by_category(self, check_page_length=True):
         # Returns questions by category to views.
@@ -126,46 +331,58 @@ class Questions:
             raise StatusError(ERROR_404, CATEGORY_NOT_FOUND, 404)
         # Structures data, and builds response JSON.
         self.data.questions = self.questions.list
-        self.data.total_questions = len(self.query)
+        self.data.total_questions = self.questions.total
         self.data.current_category = self.category_id
-        self.response = jsonify(self.data.__dict__), 200
+        if self.questions.paginated:
+            self.data.next_cursor = self.questions.next_cursor
+        self.response = json_response(self.data.__dict__), 200
 
     def get_all_questions(self):
-        # Returns a list of all questions in the database.
-        return Question.query.order_by(Question.id).all()
+        # Returns a query for all questions in the database. Queries
+        # are not executed here so QuestionsPage can paginate in SQL.
+        return Question.query.order_by(Question.id)
 
     def get_search_questions(self, search_term):
-        # Returns a list of questions matching keyword(s).
-        return Question.query.filter(Question.question
-                                     .ilike(f'%{search_term}%')).all()
+        # Returns a ranked query for questions or answers matching
+        # keyword(s), using the search index where available.
+        return search_questions(search_term)
 
     def get_questions_by_category(self, category_id):
-        # Returns a list of questions matching category id.
-        return Question.query.filter(Question.category == category_id).all()
+        # Returns a query for questions matching category id.
+        return (Question.query
+                .filter(Question.category == category_id)
+                .order_by(Question.id))
 
 
 # Deletes question from database.
 class DeleteQuestion:
     def __init__(self, question_id):
         self.data = SimpleNamespace(success=True)
+        # Reads from the primary, so a question just added is found even
+        # if a replica hasn't received it yet.
+        use_primary(db.session)
         this_question = self.get_single_question(question_id)
         # Returns 404 if a delete request is sent for a non-existent
         # question.
         if this_question is None:
             raise StatusError(ERROR_404, QUESTION_NOT_FOUND, 404)
 
+        # Deleting through the ORM invalidates cached listings of the
+        # question's category, see cache.py.
         this_question.delete()
-        questions = Questions()
-        # Disables page length check so user does not receive
-        # an error when deleting last question on page.
-        questions.all(check_page_length=False)
-
         self.data.deleted = question_id
-        self.data.questions = questions.data.questions
-        self.data.total_questions = (
-            questions.data.total_questions
-        )
-        self.response = jsonify(self.data.__dict__), 200
+        query = Questions().get_all_questions()
+        # Returns only the updated count if questions are not requested.
+        if request.args.get('include_questions') == 'false':
+            self.data.total_questions = query.order_by(None).count()
+        # Otherwise lists questions, paginated in SQL if a page is
+        # requested. Does not check page length so user does not
+        # receive an error when deleting last question on page.
+        else:
+            questions = QuestionsPage(request, query)
+            self.data.questions = questions.list
+            self.data.total_questions = questions.total
+        self.response = json_response(self.data.__dict__), 200
 
     def get_single_question(self, question_id):
         # Returns a question from the database by id.
@@ -176,53 +393,195 @@ class DeleteQuestion:
 class PostQuestion:
     def __init__(self, form_data=None):
         self.data = SimpleNamespace(success=True)
-        # Checks attributes exist.
-        if (not hasattr(form_data, 'question') or
-                not hasattr(form_data, 'answer') or
-                not hasattr(form_data, 'difficulty') or
-                not hasattr(form_data, 'category')):
-            raise StatusError(ERROR_422, QUESTION_FIELDS_ERR, 422)
-
-        # Checks that form data is not empty strings.
-        if (form_data.question.strip() == '' or form_data.answer.strip() == ''
-                or form_data.difficulty == '' or form_data.category == ''):
-            raise StatusError(ERROR_422, QUESTION_FIELDS_ERR, 422)
-        # Verify integer and category exists or error.
-        if (type(form_data.category)) != int:
-            try:
-                form_data.category = int(form_data.category)
-            except ValueError:
-                raise StatusError(ERROR_422, ADD_QUESTION_CATEGORY_ERR, 422)
-        elif not Categories().category_exists(form_data.category):
-            raise StatusError(ERROR_422, ADD_QUESTION_CATEGORY_ERR, 422)
-        # Verify integer and in range or error.
-        form_data.difficulty = string_to_int(form_data.difficulty,
-                                             ADD_QUESTION_DIFFICULTY_ERR)
-        if form_data.difficulty < 1 or form_data.difficulty > 5:
-            raise StatusError(ERROR_422, ADD_QUESTION_DIFFICULTY_ERR, 422)
+        # Verifies fields against the cached categories.
+        check_question_form(form_data, Categories().list)
 
         this_question = Question(
-            question=form_data.question.strip(),
-            answer=form_data.answer.strip(),
+            question=form_data.question,
+            answer=form_data.answer,
             difficulty=form_data.difficulty,
             category=form_data.category
         )
-        # Get latest question before insert.
-        last_question = self.get_last_question()
-        this_question.insert()
-        # Get latest question after insert.
-        new_question = self.get_last_question()
-        # Check new question id is greater than latest question id
-        # before insert.
-        if last_question.id >= new_question.id:
-            raise StatusError(ERROR_500, None, 500)
+        # Gets the new question id from the insert itself. Inserting
+        # through the ORM invalidates cached listings of the question's
+        # category, see cache.py.
+        question_id = this_question.insert()
         # Structures data and builds response JSON.
-        self.data.created = new_question.id
-        self.response = jsonify(self.data.__dict__), 200
+        self.data.created = question_id
+        self.response = json_response(self.data.__dict__), 200
+
 
-    def get_last_question(self):
-        # Returns newest question from the database.
-        return Question.query.order_by(Question.id.desc()).first()
+# Imports questions to the database in batches.
+class ImportQuestions:
+    def __init__(self, request):
+        self.data = SimpleNamespace(success=True)
+        # Looks up categories once for every row.
+        categories = Categories().list
+        batch = []
+        imported = 0
+        rows = 0
+        errors = []
+        error_count = 0
+
+        for row_number, row in self.read_rows(request):
+            rows += 1
+            # Validates each row with the rules for a single question,
+            # and records errors by row number rather than stopping.
+            try:
+                # Rows that can't be read are passed as their error.
+                if isinstance(row, StatusError):
+                    raise row
+                if type(row) != dict:
+                    raise StatusError(ERROR_422, QUESTION_FIELDS_ERR, 422)
+                form_data = SimpleNamespace(
+                    **{key: value for key, value in row.items()
+                       if type(key) == str})
+                check_question_form(form_data, categories)
+            except StatusError as error:
+                error_count += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({'row': row_number,
+                                   'description': error.description})
+                continue
+            batch.append({
+                'question': form_data.question,
+                'answer': form_data.answer,
+                'difficulty': form_data.difficulty,
+                'category': form_data.category
+            })
+            # Inserts and commits a batch at a time.
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                imported += self.insert_batch(batch)
+                batch = []
+        if batch:
+            imported += self.insert_batch(batch)
+        # Returns 400 if the request contains no rows.
+        if rows < 1:
+            raise StatusError(ERROR_400, INVALID_SYNTAX, 400)
+        # Structures data and builds response JSON.
+        self.data.imported = imported
+        self.data.error_count = error_count
+        self.data.errors = errors
+        self.response = json_response(self.data.__dict__), 200
+
+    def read_rows(self, request):
+        # Yields (row number, row) for a JSON array, or streams rows from
+        # NDJSON or CSV without reading the whole body into memory.
+        if request.mimetype == 'application/json':
+            rows = request.get_json(silent=True)
+            if type(rows) != list:
+                raise StatusError(ERROR_400, INVALID_SYNTAX, 400)
+            yield from enumerate(rows, start=1)
+        elif request.mimetype in ('application/x-ndjson', 'text/csv'):
+            # Lines that aren't UTF-8 are row errors, counted in
+            # invalid_lines, rather than failing the whole import.
+            invalid_lines = []
+            lines = decode_lines(request.stream, invalid_lines)
+            if request.mimetype == 'text/csv':
+                reader = csv.DictReader(lines)
+                # Without a readable header no row can be read.
+                if not reader.fieldnames or invalid_lines:
+                    raise StatusError(ERROR_400, IMPORT_FORMAT_ERR, 400)
+                # Row 1 is the header.
+                row_number = 1
+                for row in reader:
+                    while invalid_lines:
+                        invalid_lines.pop()
+                        row_number += 1
+                        yield row_number, StatusError(
+                            ERROR_422, IMPORT_ENCODING_ERR, 422)
+                    row_number += 1
+                    yield row_number, row
+                for invalid_line in invalid_lines:
+                    row_number += 1
+                    yield row_number, StatusError(
+                        ERROR_422, IMPORT_ENCODING_ERR, 422)
+            else:
+                for row_number, line in enumerate(lines, start=1):
+                    if invalid_lines:
+                        invalid_lines.pop()
+                        yield row_number, StatusError(
+                            ERROR_422, IMPORT_ENCODING_ERR, 422)
+                    elif line.strip() == '':
+                        continue
+                    else:
+                        try:
+                            yield row_number, json.loads(line)
+                        except ValueError:
+                            yield row_number, None
+        else:
+            raise StatusError(ERROR_400, IMPORT_FORMAT_ERR, 400)
+
+    def insert_batch(self, batch):
+        # Inserts a batch of questions with one executemany and commits.
+        db.session.bulk_insert_mappings(Question, batch)
+        # Bulk inserts skip ORM events, so count the batch's questions in
+        # the category stats here, in the same transaction.
+        add_question_counts(db.session.connection(), Counter(
+            (question['category'], question['difficulty'])
+            for question in batch))
+        db.session.commit()
+        content_version.bump()
+        # Bulk inserts skip ORM events, so reload the quiz question index
+        # and invalidate cached listings of the batch's categories here.
+        question_index.invalidate()
+        response_cache.invalidate_questions(
+            *{question['category'] for question in batch})
+        return len(batch)
+
+
+# Streams all questions, or a category's questions, as NDJSON.
+class ExportQuestions:
+    def __init__(self, request):
+        category_id = request.args.get('category')
+        compress = request.args.get('gzip') == 'true'
+        if category_id is None:
+            query = Questions().get_all_questions()
+        else:
+            # Verifies that the category id is a positive integer, and
+            # that the category exists.
+            category_id = string_to_int(category_id, CATEGORY_INT_ERR)
+            if category_id < 1:
+                raise StatusError(ERROR_422, CATEGORY_INT_ERR, 422)
+            if not Categories().category_exists(category_id):
+                raise StatusError(ERROR_404, CATEGORY_NOT_FOUND, 404)
+            query = Questions().get_questions_by_category(category_id)
+        # Fetches rows through a server-side cursor in chunks, so memory
+        # stays flat however many questions there are.
+        rows = (question_rows(query)
+                .execution_options(stream_results=True)
+                .yield_per(EXPORT_CHUNK_SIZE))
+        chunks = self.generate_chunks(rows)
+        if compress:
+            chunks = self.compress_chunks(chunks)
+            self.response = current_app.response_class(
+                stream_with_context(chunks), mimetype='application/gzip',
+                headers={'Content-Disposition':
+                         'attachment; filename=questions.ndjson.gz'}), 200
+        else:
+            self.response = current_app.response_class(
+                stream_with_context(chunks),
+                mimetype='application/x-ndjson'), 200
+
+    def generate_chunks(self, rows):
+        # Yields a chunk of NDJSON lines per EXPORT_CHUNK_SIZE questions.
+        lines = []
+        for question in format_rows_iter(rows):
+            lines.append(dumps(question))
+            if len(lines) >= EXPORT_CHUNK_SIZE:
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+
+    def compress_chunks(self, chunks):
+        # Compresses chunks as one gzip stream.
+        compressor = zlib.compressobj(wbits=31)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
 
 
 # Gets quiz questions to pass to views.
@@ -231,57 +590,229 @@ class Quiz:
         self.form_data = form_data
         self.data = SimpleNamespace(success=True)
         # Verifies fields
-        if (not hasattr(form_data, 'quiz_category') or
-                not hasattr(form_data, 'previous_questions')):
-            raise StatusError(ERROR_422, QUIZ_CATEGORY_ERR, 422)
-        # Verifies that category id is an integer and not a negative value.
-        form_data.quiz_category = string_to_int(form_data.quiz_category,
-                                                QUIZ_CATEGORY_ERR)
-        if form_data.quiz_category < 0:
-            raise StatusError(ERROR_422, QUIZ_CATEGORY_ERR, 422)
-        # Verifies that previous questions are passed as a list
-        # and are only integers.
-        if type(form_data.previous_questions) == list:
-            for question in form_data.previous_questions:
-                question = string_to_int(question, PREVIOUS_LIST_ERR)
-        else:
-            raise StatusError(ERROR_422, PREVIOUS_LIST_ERR, 422)
+        check_quiz_form(form_data)
 
-        all_questions = self.get_quizz_questions(form_data.quiz_category)
-        # Verifies that there are quiz questions.
-        if len(all_questions) < 1:
-            raise StatusError(ERROR_404, CATEGORY_NOT_FOUND, 404)
-        # Selects list of questions that are not in previous questions.
-        available_questions = [question for question in all_questions if
-                               question.id not in form_data.previous_questions]
-        # If the list of available questions becomes empty, passes
-        # None to the view as a quiz end condition.
-        if available_questions:
-            this_question = random.choice(available_questions).format()
+        this_question = pick_question(form_data.quiz_category, None,
+                                      form_data.previous_questions)
+        # If no questions are available, verifies that there are quiz
+        # questions, and passes None to the view as a quiz end condition.
+        if this_question is None:
+            if not question_index.has_questions(form_data.quiz_category):
+                raise StatusError(ERROR_404, CATEGORY_NOT_FOUND, 404)
         else:
-            this_question = None
+            this_question = this_question.format()
         # Structures data and builds reponse JSON.
         self.data.question = this_question
-        self.response = jsonify(self.data.__dict__), 200
+        self.response = json_response(self.data.__dict__), 200
 
-    def get_quizz_questions(self, category_id):
-        # Gets questions by category, or gets all questions
+
+# Gets the next questions of a quiz in one request, so clients can fetch
+# a whole round at once.
+class QuizBatch:
+    def __init__(self, form_data=None):
+        self.form_data = form_data
+        self.data = SimpleNamespace(success=True)
+        # Verifies fields
+        check_quiz_form(form_data)
+        count = string_to_int(getattr(form_data, 'count', QUIZ_BATCH_SIZE),
+                              QUIZ_BATCH_COUNT_ERR)
+        if count < 1 or count > QUIZ_BATCH_MAX:
+            raise StatusError(ERROR_422, QUIZ_BATCH_COUNT_ERR, 422)
+
+        questions = self.pick_questions(form_data.quiz_category,
+                                        form_data.previous_questions, count)
+        # If no questions are available, verifies that there are quiz
+        # questions, and passes an empty list to the view as a quiz end
+        # condition.
+        if not questions:
+            if not question_index.has_questions(form_data.quiz_category):
+                raise StatusError(ERROR_404, CATEGORY_NOT_FOUND, 404)
+        # Structures data and builds reponse JSON.
+        self.data.questions = questions
+        self.response = json_response(self.data.__dict__), 200
+
+    def pick_questions(self, category_id, previous_questions, count):
+        # Picks question ids from the question index and fetches them in
+        # one query, in the order picked. Ids of questions deleted by
+        # another process are dropped from the index and replaced.
+        questions = []
+        while len(questions) < count:
+            question_ids = question_index.sample_many(
+                category_id, None, previous_questions,
+                count - len(questions))
+            if not question_ids:
+                break
+            rows = {row.id: row for row in question_rows(
+                Question.query.filter(Question.id.in_(question_ids)))}
+            for question_id in question_ids:
+                previous_questions.add(question_id)
+                if question_id in rows:
+                    questions.append(rows[question_id])
+                else:
+                    question_index.discard(question_id)
+        return format_rows(questions)
+
+
+# Serves quiz questions that get harder after a correct answer and easier
+# after a wrong one, picked from the question index, see question_index.py.
+class AdaptiveQuiz:
+    def __init__(self, form_data=None):
+        self.form_data = form_data
+        self.data = SimpleNamespace(success=True)
+        # Verifies fields
+        if form_data.mode != 'adaptive':
+            raise StatusError(ERROR_422, QUIZ_MODE_ERR, 422)
+        check_quiz_form(form_data)
+        difficulty = self.next_difficulty(form_data)
+        previous_questions = form_data.previous_questions
+
+        this_question = None
+        for question_difficulty in self.difficulty_order(
+                difficulty, getattr(form_data, 'last_answer_correct', None)):
+            this_question = pick_question(
+                form_data.quiz_category, question_difficulty,
+                previous_questions)
+            if this_question is not None:
+                difficulty = question_difficulty
+                break
+        # If no questions are available, verifies that there are quiz
+        # questions, and passes None to the view as a quiz end condition.
+        if this_question is None:
+            if not question_index.has_questions(form_data.quiz_category):
+                raise StatusError(ERROR_404, CATEGORY_NOT_FOUND, 404)
+        else:
+            this_question = this_question.format()
+        # Structures data and builds reponse JSON. The client sends the
+        # difficulty back with the answer to get the next question.
+        self.data.question = this_question
+        self.data.difficulty = difficulty
+        self.response = json_response(self.data.__dict__), 200
+
+    def next_difficulty(self, form_data):
+        # Steps the difficulty of the last question up after a correct
+        # answer, or down after a wrong one, within 1 to 5.
+        difficulty = string_to_int(
+            getattr(form_data, 'difficulty', ADAPTIVE_START_DIFFICULTY),
+            QUIZ_DIFFICULTY_ERR)
+        if difficulty < 1 or difficulty > 5:
+            raise StatusError(ERROR_422, QUIZ_DIFFICULTY_ERR, 422)
+        last_answer_correct = getattr(form_data, 'last_answer_correct', None)
+        # Checks the type, since 1 and 0 equal True and False.
+        if (last_answer_correct is not None and
+                type(last_answer_correct) != bool):
+            raise StatusError(ERROR_422, QUIZ_ANSWER_ERR, 422)
+        if last_answer_correct is True:
+            return min(difficulty + 1, 5)
+        if last_answer_correct is False:
+            return max(difficulty - 1, 1)
+        return difficulty
+
+    def difficulty_order(self, difficulty, last_answer_correct):
+        # Orders difficulties by distance from the target, so a quiz that
+        # has run out of questions of one difficulty moves to the nearest.
+        # Ties go the way the last answer moved the difficulty.
+        direction = -1 if last_answer_correct is True else 1
+        return sorted(range(1, 6), key=lambda question_difficulty: (
+            abs(question_difficulty - difficulty),
+            direction * question_difficulty))
+
+
+# Serves quiz questions from a server-side session, see sessions.py.
+class QuizSession:
+    def __init__(self, form_data=None):
+        self.form_data = form_data
+        self.data = SimpleNamespace(success=True)
+        self.store = current_app.config['QUIZ_SESSION_STORE']
+        session_id = getattr(form_data, 'session_id', None)
+        # Starts a new session if no session id is passed.
+        if session_id is None:
+            session_id = self.start_session(form_data)
+        # Session ids are strings, so other values can't match a session.
+        elif type(session_id) != str:
+            raise StatusError(ERROR_404, QUIZ_SESSION_NOT_FOUND, 404)
+        # Pops question ids until one still exists, so questions deleted
+        # during the session are skipped.
+        this_question = None
+        try:
+            question_id = self.store.pop(session_id)
+            while question_id is not None and this_question is None:
+                this_question = Question.query.get(question_id)
+                if this_question is None:
+                    question_id = self.store.pop(session_id)
+        except KeyError:
+            raise StatusError(ERROR_404, QUIZ_SESSION_NOT_FOUND, 404)
+        # When the session runs out of questions, ends it and passes
+        # None to the view as a quiz end condition.
+        if this_question is None:
+            self.store.delete(session_id)
+        # Structures data and builds reponse JSON.
+        self.data.question = (this_question.format()
+                              if this_question is not None else None)
+        self.data.session_id = session_id
+        self.response = json_response(self.data.__dict__), 200
+
+    def start_session(self, form_data):
+        # Shuffles the ids of the quiz questions once, excluding previous
+        # questions, and stores them as the session queue.
+        check_quiz_form(form_data)
+        question_ids = [
+            question.id for question in
+            self.get_quizz_question_ids(form_data.quiz_category)]
+        # Verifies that there are quiz questions.
+        if len(question_ids) < 1:
+            raise StatusError(ERROR_404, CATEGORY_NOT_FOUND, 404)
+        previous_questions = form_data.previous_questions
+        question_ids = [question_id for question_id in question_ids
+                        if question_id not in previous_questions]
+        random.shuffle(question_ids)
+        return self.store.create(question_ids)
+
+    def get_quizz_question_ids(self, category_id):
+        # Gets only the ids of questions by category, or of all questions
         # if category id is set to 0.
         if category_id != 0:
-            return Questions().get_questions_by_category(str(category_id))
+            query = Questions().get_questions_by_category(category_id)
         else:
-            return Questions().get_all_questions()
+            query = Questions().get_all_questions()
+        return query.with_entities(Question.id)
 
 
 # Creates pagination for views.
 class QuestionsPage:
-    def __init__(self, request, question_query):
+    def __init__(self, request, question_query, ranked=False):
         page = request.args.get('page')
-
+        after = request.args.get('after')
+        # Cursors continue from a question id, so they only work for
+        # queries in id order. Ranked queries, such as search, are
+        # paginated by page only.
+        if ranked and after is not None:
+            raise StatusError(ERROR_422, RANKED_CURSOR_ERR, 422)
+        # Flags whether the response is paginated so views only receive
+        # a next_cursor for paginated responses.
+        self.paginated = page is not None or after is not None
+        self.next_cursor = None
+        # Counts matching questions in the database rather than loading
+        # them, so only the rows on the requested page are fetched.
+        self.total = question_query.order_by(None).count()
+        # Fetches questions as column tuples rather than ORM objects.
+        question_query = question_rows(question_query)
+
+        # If a cursor is passed, returns the page after the question id
+        # it encodes. An empty cursor starts from the first question.
+        if after is not None:
+            last_id = decode_cursor(after) if after != '' else 0
+            question_query = (question_query
+                              .filter(Question.id > last_id)
+                              .order_by(None).order_by(Question.id)
+                              .limit(QUESTIONS_PER_PAGE + 1))
+            questions = question_query.all()
+            # Fetches one extra question to check for a next page.
+            if len(questions) > QUESTIONS_PER_PAGE:
+                questions = questions[:QUESTIONS_PER_PAGE]
+                self.next_cursor = encode_cursor(questions[-1].id)
         # If page is none, returns all questions
-        if page is None:
-            start = 0
-            stop = None
+        elif page is None:
+            questions = question_query.all()
         # Checks if page can be converted to a positive integer, and
         # paginates response. Otherwise, returns a 422 error.
         else:
@@ -290,7 +821,12 @@ class QuestionsPage:
                 raise StatusError(ERROR_422, PAGE_INT_ERR, 422)
             # Page length can be configured in config.py
             start = (page - 1) * QUESTIONS_PER_PAGE
-            stop = start + QUESTIONS_PER_PAGE
+            questions = (question_query
+                         .limit(QUESTIONS_PER_PAGE).offset(start).all())
+            # Provides a cursor so clients can continue from this page
+            # without an offset.
+            if (not ranked and questions and
+                    start + len(questions) < self.total):
+                self.next_cursor = encode_cursor(questions[-1].id)
         # Formats questions for views.
-        self.list = (([question.format() for question
-                       in question_query])[start:stop])
+        self.list = format_rows(questions)
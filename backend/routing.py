@@ -0,0 +1,161 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import logging
+import random
+import time
+from threading import Lock
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, BaseQuery
+from sqlalchemy import event, orm
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.sql.selectable import SelectBase
+from versioning import content_version
+from config import (DB_REPLICA_CHECK_INTERVAL, DB_REPLICA_RETRY,
+                    DB_REPLICA_LAG_GRACE)
+
+logger = logging.getLogger(__name__)
+
+""" ---------------------------------------------------------------------------
+# Read Replicas
+# --------------------------------------------------------------------------"""
+
+
+# Holds the engines of read replicas, and which of them are healthy. A
+# replica is checked with a query before use when it hasn't been checked
+# for DB_REPLICA_CHECK_INTERVAL seconds, and is skipped for
+# DB_REPLICA_RETRY seconds after a failed check or connection error.
+class ReplicaSet:
+    def __init__(self, engines, check_interval=DB_REPLICA_CHECK_INTERVAL,
+                 retry=DB_REPLICA_RETRY, lag_grace=DB_REPLICA_LAG_GRACE):
+        self.engines = engines
+        self.check_interval = check_interval
+        self.retry = retry
+        # Seconds after a write during which reads go to the primary, so
+        # listings cached or tagged with an ETag straight after a write
+        # don't come from a replica that hasn't received it yet.
+        self.lag_grace = lag_grace
+        self.checked = {engine: 0 for engine in engines}
+        self.down_until = {engine: 0 for engine in engines}
+        self.last_write = None
+        self.lock = Lock()
+        for engine in engines:
+            event.listen(engine, 'handle_error', self.connection_error)
+
+    def choose(self):
+        # Returns a random healthy replica, or None if none are healthy.
+        engines = list(self.engines)
+        random.shuffle(engines)
+        for engine in engines:
+            if self.healthy(engine):
+                return engine
+        return None
+
+    def healthy(self, engine):
+        now = time.monotonic()
+        with self.lock:
+            if now < self.down_until[engine]:
+                return False
+            if now - self.checked[engine] < self.check_interval:
+                return True
+            self.checked[engine] = now
+        try:
+            with engine.connect() as connection:
+                connection.execute('SELECT 1')
+        except Exception:
+            self.mark_down(engine)
+            return False
+        return True
+
+    def mark_down(self, engine):
+        with self.lock:
+            self.down_until[engine] = time.monotonic() + self.retry
+
+    def connection_error(self, context):
+        # Skips a replica after it loses or can't open a connection.
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def written(self):
+        self.last_write = time.time()
+
+    def recently_written(self):
+        # Checks for a write within lag_grace seconds, by this process or,
+        # from when the shared content version last changed, by any other
+        # process that shares it.
+        last_write = max(self.last_write or 0, content_version.changed_at())
+        return time.time() - last_write < self.lag_grace
+
+
+""" ---------------------------------------------------------------------------
+# Routing Session
+# --------------------------------------------------------------------------"""
+
+
+# Sends SELECTs to a read replica, when the app has replicas, and
+# everything else, including flushes, to the primary. A session keeps the
+# replica chosen for its first read, so every read of a request sees the
+# same replica, and reads from the primary if no replica is healthy or
+# questions changed within the grace period. Once a session has written,
+# or use_primary has been called, its reads also go to the primary, so a
+# request reads its own writes. Sessions are removed at the end of each
+# request, so this lasts for the request.
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get('replicas')
+        if replicas is not None and replicas.engines:
+            if not isinstance(clause, SelectBase) or self._flushing:
+                use_primary(self)
+                replicas.written()
+            elif not self.info.get('use_primary'):
+                if 'replica' not in self.info:
+                    self.info['replica'] = (None if replicas.recently_written()
+                                            else replicas.choose())
+                if self.info['replica'] is not None:
+                    return self.info['replica']
+        return super().get_bind(mapper, clause)
+
+    def execute(self, clause, params=None, mapper=None, bind=None, **kw):
+        return retry_on_primary(self, lambda: super(
+            RoutingSession, self).execute(clause, params, mapper, bind, **kw))
+
+
+# Runs queries through the session's routing, retried on the primary if
+# the replica fails.
+class RoutingQuery(BaseQuery):
+    def _execute_and_instances(self, querycontext):
+        return retry_on_primary(self.session, lambda: super(
+            RoutingQuery, self)._execute_and_instances(querycontext))
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('query_class', RoutingQuery)
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def retry_on_primary(session, execute):
+    # Runs execute, and if it fails on the session's replica, for example
+    # because the replica went down after its health check, skips the
+    # replica and runs it again on the primary.
+    try:
+        return execute()
+    except (OperationalError, InterfaceError) as error:
+        # Statements that didn't run on a replica aren't retried.
+        replica = session.info.get('replica')
+        if replica is None or session.info.get('use_primary'):
+            raise
+        logger.warning('read replica failed, retrying on the primary: %s',
+                       error)
+        session.app.extensions['replicas'].mark_down(replica)
+        use_primary(session)
+        return execute()
+
+
+def use_primary(session):
+    # Sends the rest of a session's queries to the primary, for requests
+    # that read what they are about to write.
+    session.info['use_primary'] = True
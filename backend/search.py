@@ -0,0 +1,139 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import logging
+import sqlite3
+from sqlalchemy import bindparam, or_, desc, func, text
+from sqlalchemy.sql import table, column
+from sqlalchemy.exc import SQLAlchemyError
+from models import Question
+from config import SEARCH_MIN_INDEXED_LENGTH
+
+logger = logging.getLogger(__name__)
+
+""" ---------------------------------------------------------------------------
+# Search Indexes
+# --------------------------------------------------------------------------"""
+
+# Records which index backs search for the configured database, set by
+# setup_search. Without an index, search falls back to a pattern match.
+SEARCH_BACKEND = {'name': None}
+
+# PostgreSQL trigram indexes let ILIKE '%term%' use an index scan on both
+# searchable columns. They are added by
+# migrations/004_question_search_trigram.sql rather than on startup, since
+# building them locks questions against writes. Indexes left invalid by a
+# failed concurrent build aren't counted.
+POSTGRES_INDEXES = ('ix_questions_question_trgm', 'ix_questions_answer_trgm')
+POSTGRES_INDEX_COUNT = ("SELECT count(*) FROM pg_index JOIN pg_class "
+                        "ON pg_class.oid = pg_index.indexrelid "
+                        "WHERE pg_class.relname IN :names "
+                        "AND pg_index.indisvalid")
+
+# SQLite full-text table using the trigram tokenizer, which matches
+# substrings like ILIKE. Triggers keep it in sync with questions.
+SQLITE_INDEX = ("CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING "
+                "fts5(question, answer, content='questions', "
+                "content_rowid='id', tokenize='trigram')")
+SQLITE_TRIGGERS = [
+    ("CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT "
+     "ON questions BEGIN INSERT INTO questions_fts(rowid, question, answer) "
+     "VALUES (new.id, new.question, new.answer); END"),
+    ("CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE "
+     "ON questions BEGIN INSERT INTO questions_fts(questions_fts, rowid, "
+     "question, answer) VALUES ('delete', old.id, old.question, "
+     "old.answer); END"),
+    ("CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE "
+     "ON questions BEGIN INSERT INTO questions_fts(questions_fts, rowid, "
+     "question, answer) VALUES ('delete', old.id, old.question, "
+     "old.answer); INSERT INTO questions_fts(rowid, question, answer) "
+     "VALUES (new.id, new.question, new.answer); END")
+]
+SQLITE_REBUILD = "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"
+SQLITE_TRIGGER_COUNT = ("SELECT count(*) FROM sqlite_master WHERE "
+                        "type = 'trigger' AND name LIKE 'questions_fts_%'")
+
+questions_fts = table('questions_fts', column('rowid'), column('rank'))
+
+
+def setup_search(engine):
+    # Detects the PostgreSQL search indexes, or creates the SQLite search
+    # index. Errors are logged rather than raised so the API still serves
+    # search by pattern match where there is no index.
+    dialect = engine.dialect.name
+    try:
+        if dialect == 'postgresql':
+            with engine.connect() as connection:
+                index_count = connection.execute(
+                    text(POSTGRES_INDEX_COUNT).bindparams(
+                        bindparam('names', expanding=True)),
+                    names=list(POSTGRES_INDEXES)).scalar()
+            if index_count < len(POSTGRES_INDEXES):
+                logger.warning('search indexes missing, using pattern '
+                               'match: run migrations/'
+                               '004_question_search_trigram.sql')
+                SEARCH_BACKEND['name'] = None
+            else:
+                SEARCH_BACKEND['name'] = 'trigram'
+        # The trigram tokenizer is available from SQLite 3.34.
+        elif (dialect == 'sqlite' and
+                sqlite3.sqlite_version_info >= (3, 34, 0)):
+            with engine.begin() as connection:
+                # Rebuilds the index if the table or its triggers are
+                # missing, since questions may have changed without it.
+                if (not engine.dialect.has_table(connection,
+                                                 'questions_fts') or
+                        connection.execute(text(SQLITE_TRIGGER_COUNT))
+                        .scalar() < len(SQLITE_TRIGGERS)):
+                    connection.execute(text(SQLITE_INDEX))
+                    for statement in SQLITE_TRIGGERS:
+                        connection.execute(text(statement))
+                    connection.execute(text(SQLITE_REBUILD))
+            SEARCH_BACKEND['name'] = 'fts5'
+        else:
+            SEARCH_BACKEND['name'] = None
+    except SQLAlchemyError as error:
+        logger.warning('search index unavailable, using pattern match: %s',
+                       error)
+        SEARCH_BACKEND['name'] = None
+
+
+""" ---------------------------------------------------------------------------
+# Search Queries
+# --------------------------------------------------------------------------"""
+
+
+def search_questions(search_term):
+    # Returns a query for questions whose question or answer contains
+    # the search term, ranked by relevance.
+    search_term = search_term.strip()
+    pattern = f'%{search_term}%'
+    backend = SEARCH_BACKEND['name']
+    # Terms shorter than a trigram can't be matched by the index.
+    if len(search_term) < SEARCH_MIN_INDEXED_LENGTH:
+        backend = None
+
+    if backend == 'fts5':
+        # Quotes the term as a phrase so it matches as a substring.
+        phrase = '"{}"'.format(search_term.replace('"', '""'))
+        return (Question.query
+                .join(questions_fts, questions_fts.c.rowid == Question.id)
+                .filter(text('questions_fts MATCH :search_phrase'))
+                .params(search_phrase=phrase)
+                .order_by(questions_fts.c.rank, Question.id))
+
+    query = Question.query.filter(or_(Question.question.ilike(pattern),
+                                      Question.answer.ilike(pattern)))
+    if backend == 'trigram':
+        # Ranks by the closest trigram similarity of either column.
+        return query.order_by(
+            desc(func.greatest(func.similarity(Question.question,
+                                               search_term),
+                               func.similarity(Question.answer,
+                                               search_term))),
+            Question.id)
+    # Without an index, ranks questions matching on the question text
+    # ahead of matches on the answer.
+    return query.order_by(
+        Question.question.ilike(pattern).desc(), Question.id)
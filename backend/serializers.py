@@ -0,0 +1,54 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import json
+from flask import current_app
+from models import Question
+
+# orjson is optional. It serializes several times faster than json, which
+# is used when it isn't installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+""" ---------------------------------------------------------------------------
+# Serializers
+# --------------------------------------------------------------------------"""
+
+# Columns of a question, in the order of the rows from question_rows.
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty)
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def question_rows(question_query):
+    # Limits a question query to the question columns, so rows are
+    # fetched as tuples rather than ORM objects.
+    return question_query.with_entities(*QUESTION_COLUMNS)
+
+
+def format_rows(rows):
+    # Formats question rows for views, like Question.format().
+    return list(format_rows_iter(rows))
+
+
+def format_rows_iter(rows):
+    # Formats question rows one at a time, for streamed responses.
+    for row in rows:
+        yield dict(zip(QUESTION_FIELDS, row))
+
+
+def dumps(data):
+    # Serializes data to compact JSON bytes. Category maps have integer
+    # keys, which json converts to strings and orjson needs allowed.
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def json_response(data):
+    # Builds a JSON response without pretty-printing, in place of jsonify.
+    return current_app.response_class(dumps(data),
+                                      mimetype='application/json')
@@ -0,0 +1,69 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import secrets
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+from config import QUIZ_SESSION_TTL, QUIZ_SESSION_MAX
+
+""" ---------------------------------------------------------------------------
+# Quiz Session Stores
+# --------------------------------------------------------------------------"""
+
+
+# Stores quiz sessions as queues of question ids in process memory.
+#
+# Other stores can be configured with app.config['QUIZ_SESSION_STORE'],
+# and need the same three methods: create(question_ids) returns a new
+# session id, pop(session_id) returns the next question id or None when
+# the queue is empty, and raises KeyError for an unknown or expired
+# session, and delete(session_id) ends a session. A shared store, such
+# as a Redis list with RPUSH/LPOP and EXPIRE, is needed when quiz
+# requests are load balanced across processes.
+class MemorySessionStore:
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # Ordered by last use, so the least recently used session is
+        # evicted first when the store is full.
+        self.sessions = OrderedDict()
+        self.lock = Lock()
+
+    def create(self, question_ids):
+        # Stores a queue of question ids and returns its session id.
+        session_id = secrets.token_urlsafe(16)
+        with self.lock:
+            self.purge()
+            while len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)
+            self.sessions[session_id] = (deque(question_ids),
+                                         time.monotonic() + self.ttl)
+        return session_id
+
+    def pop(self, session_id):
+        # Returns the next question id in the session in O(1).
+        with self.lock:
+            queue, expires = self.sessions[session_id]
+            if time.monotonic() >= expires:
+                del self.sessions[session_id]
+                raise KeyError(session_id)
+            # Each round extends the session.
+            self.sessions[session_id] = (queue, time.monotonic() + self.ttl)
+            self.sessions.move_to_end(session_id)
+            return queue.popleft() if queue else None
+
+    def delete(self, session_id):
+        # Ends a session.
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def purge(self):
+        # Drops expired sessions, oldest first. Callers hold the lock.
+        now = time.monotonic()
+        while self.sessions:
+            session_id, (queue, expires) = next(iter(self.sessions.items()))
+            if expires > now:
+                break
+            del self.sessions[session_id]
@@ -0,0 +1,107 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+from collections import Counter
+from sqlalchemy import event, func, inspect, select, text
+from models import db, Question, Category, CategoryStat
+
+""" ---------------------------------------------------------------------------
+# Category Stats
+# --------------------------------------------------------------------------"""
+
+# Adds to the question count of a (category, difficulty), creating its row
+# the first time. ON CONFLICT needs PostgreSQL 9.5 or SQLite 3.24.
+ADD_QUESTION_COUNT = text(
+    'INSERT INTO category_stats (category_id, difficulty, question_count) '
+    'VALUES (:category_id, :difficulty, :count) '
+    'ON CONFLICT (category_id, difficulty) DO UPDATE SET question_count = '
+    'category_stats.question_count + excluded.question_count')
+
+
+def add_question_counts(connection, counts):
+    # Applies changes in question counts, a Counter of
+    # {(category_id, difficulty): change}, in the connection's transaction.
+    # Questions without a category or difficulty aren't counted.
+    rows = [{'category_id': category_id, 'difficulty': difficulty,
+             'count': count}
+            for (category_id, difficulty), count in counts.items()
+            if count and category_id is not None and difficulty is not None]
+    if rows:
+        connection.execute(ADD_QUESTION_COUNT, rows)
+
+
+def get_category_stats():
+    # Returns {category_id: {difficulty: question_count}}, reading one row
+    # per category and difficulty rather than any questions.
+    stats = {}
+    for row in CategoryStat.query.filter(CategoryStat.question_count > 0):
+        stats.setdefault(row.category_id, {})[row.difficulty] = (
+            row.question_count)
+    return stats
+
+
+def rebuild_category_stats():
+    # Recounts every category and difficulty from the questions table, in
+    # one transaction, for example after questions are changed directly in
+    # the database.
+    stats = CategoryStat.__table__
+    db.session.execute(stats.delete())
+    db.session.execute(stats.insert().from_select(
+        ['category_id', 'difficulty', 'question_count'],
+        select([Question.category, Question.difficulty, func.count()])
+        .where(Question.category.isnot(None))
+        .where(Question.difficulty.isnot(None))
+        .group_by(Question.category, Question.difficulty)))
+    db.session.commit()
+
+
+def setup_category_stats():
+    # Counts existing questions when the stats table is new, for example
+    # on a database restored from trivia.psql.
+    if (CategoryStat.query.first() is None and
+            Question.query.first() is not None):
+        rebuild_category_stats()
+
+
+""" ---------------------------------------------------------------------------
+# Update Hooks
+# --------------------------------------------------------------------------"""
+
+
+def stored_key(target):
+    # Returns the (category, difficulty) of a question as last flushed.
+    attrs = inspect(target).attrs
+    return tuple(attrs[name].history.deleted[0]
+                 if attrs[name].history.deleted else getattr(target, name)
+                 for name in ('category', 'difficulty'))
+
+
+# Counts questions as they are flushed, in the same transaction, so the
+# stats commit or roll back with the questions. Bulk inserts skip these
+# hooks and call add_question_counts themselves.
+@event.listens_for(Question, 'after_insert')
+def question_inserted(mapper, connection, target):
+    add_question_counts(connection, Counter(
+        {(target.category, target.difficulty): 1}))
+
+
+@event.listens_for(Question, 'after_update')
+def question_updated(mapper, connection, target):
+    counts = Counter({stored_key(target): -1})
+    counts[(target.category, target.difficulty)] += 1
+    add_question_counts(connection, counts)
+
+
+@event.listens_for(Question, 'after_delete')
+def question_deleted(mapper, connection, target):
+    add_question_counts(connection, Counter({stored_key(target): -1}))
+
+
+# The database removes a deleted category's stats through the foreign key,
+# which SQLite only enforces when foreign keys are enabled.
+@event.listens_for(Category, 'after_delete')
+def category_deleted(mapper, connection, target):
+    stats = CategoryStat.__table__
+    connection.execute(stats.delete().where(
+        stats.c.category_id == target.id))
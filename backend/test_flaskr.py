@@ -4,17 +4,63 @@
 
 
 import unittest
+from unittest import mock
+import gzip
 import json
+import os
+import shutil
+import tempfile
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, text
 from flaskr import create_app
 from types import SimpleNamespace
-from models import setup_db, Question
+from models import db, Question, Category
+from cache import SharedBackend, MemoryClient, LRUBackend
+from instrumentation import MemorySink
+from question_index import (QuestionIndex, load_buckets, read_snapshot,
+                            write_snapshot)
+from versioning import ContentVersion, content_version
+from responses import encode_cursor, PreviousQuestions
 from config import (QUESTIONS_PER_PAGE, ERROR_400,  ERROR_404, ERROR_405,
                     ERROR_422, INVALID_SYNTAX, QUESTION_NOT_FOUND,
                     NO_CATEGORIES_FOUND, NO_QUESTIONS_FOUND, CATEGORY_INT_ERR,
                     QUESTION_FIELDS_ERR, PAGE_INT_ERR, CATEGORY_NOT_FOUND,
                     PREVIOUS_LIST_ERR, QUIZ_CATEGORY_ERR,
-                    ADD_QUESTION_CATEGORY_ERR, ADD_QUESTION_DIFFICULTY_ERR)
+                    ADD_QUESTION_CATEGORY_ERR, ADD_QUESTION_DIFFICULTY_ERR,
+                    CURSOR_ERR, QUIZ_SESSION_NOT_FOUND, IMPORT_FORMAT_ERR,
+                    IMPORT_ENCODING_ERR, QUIZ_MODE_ERR, QUIZ_DIFFICULTY_ERR,
+                    QUIZ_ANSWER_ERR, QUIZ_BATCH_COUNT_ERR,
+                    PREVIOUS_QUESTIONS_MAX, PREVIOUS_LIMIT_ERR,
+                    SEARCH_TERM_ERR, RANKED_CURSOR_ERR,
+                    QUIZ_REQUEST_SIZE_ERR, QUIZ_SAMPLE_ATTEMPTS)
+
+
+# prometheus_client is only needed to test /metrics.
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+""" ---------------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------------"""
+
+
+def copy_database(app, replica_path):
+    """Copies every table of the app's database to a SQLite file, as a
+    stand-in for a read replica."""
+    replica = create_engine('sqlite:///' + replica_path)
+    with app.app_context():
+        db.Model.metadata.create_all(replica)
+        for table in db.Model.metadata.sorted_tables:
+            rows = [dict(row) for row in db.engine.execute(table.select())]
+            if rows:
+                replica.execute(table.insert(), rows)
+    return replica
 
 
 """ ---------------------------------------------------------------------------
@@ -27,15 +73,14 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
         self.db_user = 'postgres'
         self.db_passw = 'postgres'
         self.database_name = 'trivia_test'
         self.database_path = ('postgres://{}:{}@{}/{}'
                               .format(self.db_user, self.db_passw,
                                       'localhost:5432', self.database_name))
-        setup_db(self.app, self.database_path)
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        self.client = self.app.test_client
 
         # binds the app to the current context
         with self.app.app_context():
@@ -59,6 +104,78 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['categories']))
         self.assertTrue(data['categories'])
 
+    def test_get_categories_cache_invalidation(self):
+        """Tests that cached categories reflect category changes."""
+        self.client().get('/api/categories')
+        with self.app.app_context():
+            category = Category(type='Monty Python')
+            db.session.add(category)
+            db.session.commit()
+            category_id = category.id
+        added = json.loads(self.client().get('/api/categories').data)
+        with self.app.app_context():
+            db.session.delete(Category.query.get(category_id))
+            db.session.commit()
+        removed = json.loads(self.client().get('/api/categories').data)
+
+        self.assertEqual(added['categories'][str(category_id)],
+                         'Monty Python')
+        self.assertNotIn(str(category_id), removed['categories'])
+
+    def test_get_categories_not_modified(self):
+        """Tests conditional GET of categories returns 304."""
+        response = self.client().get('/api/categories')
+        etag = response.headers['ETag']
+        not_modified = self.client().get(
+            '/api/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['Cache-Control'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers['ETag'], etag)
+        self.assertEqual(not_modified.data, b'')
+
+    def test_content_version_shared(self):
+        """Tests workers share the content version through its file, and
+           a version held in memory expires."""
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'content_version')
+        first_worker = ContentVersion(path=path)
+        second_worker = ContentVersion(path=path)
+        before = (first_worker.current(), second_worker.current())
+        second_worker.bump()
+        after = (first_worker.current(), second_worker.current())
+        in_memory = ContentVersion(path='', ttl=0)
+        shutil.rmtree(directory)
+
+        self.assertEqual(before[0], before[1])
+        self.assertEqual(after[0], after[1])
+        self.assertNotEqual(after[0], before[0])
+        self.assertNotEqual(in_memory.current(), in_memory.current())
+
+    def test_response_cache_other_worker(self):
+        """Tests cached listings miss after another worker writes."""
+        other_worker = ContentVersion(path=content_version.path)
+        first_response = self.client().get('/api/questions')
+        first_question = json.loads(first_response.data)['questions'][0]
+        # Changes the question as another worker would, without this
+        # process's ORM hooks.
+        with self.app.app_context():
+            db.engine.execute(
+                text('UPDATE questions SET answer = :answer WHERE id = :id'),
+                answer='Changed', id=first_question['id'])
+        other_worker.bump()
+        second_response = self.client().get('/api/questions')
+        second_question = json.loads(second_response.data)['questions'][0]
+        with self.app.app_context():
+            question = Question.query.get(first_question['id'])
+            question.answer = first_question['answer']
+            question.update()
+
+        self.assertEqual(second_response.status_code, 200)
+        self.assertEqual(second_question['id'], first_question['id'])
+        self.assertEqual(second_question['answer'], 'Changed')
+
     def test_405_post_get_categories(self):
         """Tests post method not allowed on get_categories."""
         response = self.client().post('api/categories', json={
@@ -103,6 +220,319 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], ERROR_405)
 
+    # Tests for get_pool_status
+    def test_get_pool_status(self):
+        """Tests connection pool statistics response."""
+        response = self.client().get('/api/pool')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['pool']['pool'])
+
+    # Tests for metrics
+    @unittest.skipIf(prometheus_client is None,
+                     'prometheus_client is not installed')
+    def test_get_metrics(self):
+        """Tests request metrics, including error responses."""
+        self.client().get('/api/questions')
+        self.client().post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': 100000
+        })
+        response = self.client().get('/metrics')
+        metrics = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('trivia_requests_total{endpoint="get_questions",'
+                      'method="GET",status="200"}', metrics)
+        self.assertIn('trivia_requests_total{endpoint="play_quizz",'
+                      'method="POST",status="404"}', metrics)
+        self.assertIn('trivia_request_duration_seconds_bucket{'
+                      'endpoint="play_quizz",le="0.001",method="POST",'
+                      'status="404"}', metrics)
+        # Only the metrics request itself is in progress.
+        self.assertIn('trivia_requests_in_progress 1.0', metrics)
+
+    # Tests for SQL instrumentation
+    def test_query_counts(self):
+        """Tests queries made by each endpoint, to catch N+1 queries."""
+        sink = MemorySink()
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'SQL_METRICS_SINK': sink,
+                          'RESPONSE_CACHE_BACKEND': LRUBackend()})
+        client = app.test_client()
+        # Loads categories into the category cache, and the quiz question
+        # index.
+        client.get('/api/categories')
+        client.post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': 0
+        })
+        client.get('/api/questions')
+        client.get('/api/questions?page=2')
+        client.get('/api/categories/1/questions')
+        client.post('/api/questions', json={'search_term': 'the'})
+        client.post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': 0
+        })
+        data = client.post('/api/questions', json={
+            'question': 'What is counted?',
+            'answer': 'Queries',
+            'difficulty': 1,
+            'category': 1
+        }).get_json()
+        client.delete('/api/questions/{}'.format(data['created']))
+        client.post('/api/quizzes/batch', json={
+            'previous_questions': [],
+            'quiz_category': 0,
+            'count': 10
+        })
+        query_counts = [(endpoint, stats.count)
+                        for endpoint, stats in sink.records[2:]]
+
+        self.assertEqual(query_counts, [
+            ('get_questions', 2),
+            ('get_questions', 2),
+            ('get_questions_by_category', 2),
+            ('get_questions', 2),
+            # Quizzes only fetch the chosen question.
+            ('play_quizz', 1),
+            # Adding and deleting also update the category stats.
+            ('get_questions', 2),
+            ('delete_question', 5),
+            # Quiz batches fetch every question in one query.
+            ('play_quizz_batch', 1)
+        ])
+
+    def test_server_timing(self):
+        """Tests Server-Timing header with SQL_SERVER_TIMING."""
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'SQL_SERVER_TIMING': True,
+                          'RESPONSE_CACHE_BACKEND': LRUBackend()})
+        # Loads the category cache first, so only the listing's own
+        # queries are counted.
+        app.test_client().get('/api/categories')
+        response = app.test_client().get('/api/questions?page=1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="2 queries"', response.headers['Server-Timing'])
+        self.assertIn('db-slowest;dur=', response.headers['Server-Timing'])
+        self.assertNotIn('Server-Timing',
+                         self.client().get('/api/categories').headers)
+
+    # Tests for get_category_stats
+    def test_get_category_stats(self):
+        """Tests category stats match the questions after a rebuild."""
+        result = self.app.test_cli_runner().invoke(
+            args=['rebuild-category-stats'])
+        response = self.client().get('/api/categories/stats')
+        data = json.loads(response.data)
+        with self.app.app_context():
+            counts = {(row.category, row.difficulty): row.count
+                      for row in db.session.query(
+                          Question.category, Question.difficulty,
+                          db.func.count().label('count'))
+                      .group_by(Question.category, Question.difficulty)}
+            question_count = Question.query.filter(
+                Question.category.isnot(None)).count()
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], question_count)
+        for category in data['categories']:
+            for difficulty, count in category['difficulties'].items():
+                self.assertEqual(
+                    counts.get((category['id'], int(difficulty)), 0), count)
+
+    def test_category_stats_updated(self):
+        """Tests category stats follow added, imported and deleted
+        questions."""
+        def question_count(category_id, difficulty):
+            data = json.loads(
+                self.client().get('/api/categories/stats').data)
+            category = next(category for category in data['categories']
+                            if category['id'] == category_id)
+            return category['difficulties'][str(difficulty)]
+
+        before = question_count(2, 3)
+        data = json.loads(self.client().post('/api/questions', json={
+            'question': 'Who is counted?',
+            'answer': 'Everyone',
+            'difficulty': 3,
+            'category': 2
+        }).data)
+        after_post = question_count(2, 3)
+        self.client().post('/api/questions/import', json=[{
+            'question': 'Who is counted?',
+            'answer': 'Everyone',
+            'difficulty': 3,
+            'category': 2
+        }] * 2)
+        after_import = question_count(2, 3)
+        self.client().delete('/api/questions/{}'.format(data['created']))
+        after_delete = question_count(2, 3)
+        with self.app.app_context():
+            for question in Question.query.filter(
+                    Question.question == 'Who is counted?'):
+                question.delete()
+
+        self.assertEqual(after_post, before + 1)
+        self.assertEqual(after_import, before + 3)
+        self.assertEqual(after_delete, before + 2)
+        self.assertEqual(question_count(2, 3), before)
+
+    # Tests for read replicas
+    def test_replica_reads(self):
+        """Tests reads go to a replica and writes to the primary."""
+        directory = tempfile.mkdtemp()
+        replica = copy_database(self.app,
+                                os.path.join(directory, 'replica.db'))
+        replica.execute(Question.__table__.insert(), {
+            'id': 900000, 'question': 'Where is this question?',
+            'answer': 'Only on the replica', 'category': 1, 'difficulty': 1})
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'SQLALCHEMY_REPLICA_URIS': [str(replica.url)],
+            'RESPONSE_CACHE_BACKEND': LRUBackend()
+        })
+        # Reads go to the replica even straight after earlier writes.
+        app.extensions['replicas'].lag_grace = 0
+        listing = json.loads(app.test_client().get(
+            '/api/questions?after={}'.format(encode_cursor(899999))).data)
+        created = json.loads(app.test_client().post('/api/questions', json={
+            'question': 'Where is this question?',
+            'answer': 'Only on the primary',
+            'difficulty': 1,
+            'category': 1
+        }).data)['created']
+        with self.app.app_context():
+            on_primary = Question.query.get(created) is not None
+        on_replica = replica.execute(
+            Question.__table__.select().where(Question.id == created)).first()
+        deleted = app.test_client().delete(
+            '/api/questions/{}?include_questions=false'.format(created))
+        for engine in app.extensions['replicas'].engines + [replica]:
+            engine.dispose()
+        shutil.rmtree(directory)
+
+        self.assertEqual(listing['questions'][0]['id'], 900000)
+        self.assertTrue(on_primary)
+        self.assertIsNone(on_replica)
+        self.assertEqual(deleted.status_code, 200)
+
+    def test_replica_read_your_writes(self):
+        """Tests a request reads its own writes from the primary."""
+        directory = tempfile.mkdtemp()
+        replica = copy_database(self.app,
+                                os.path.join(directory, 'replica.db'))
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'SQLALCHEMY_REPLICA_URIS': [str(replica.url)],
+            'RESPONSE_CACHE_BACKEND': LRUBackend()
+        })
+        # Reads straight after a write go to the replica, as they would
+        # once the grace period after a write has passed.
+        app.extensions['replicas'].lag_grace = 0
+        # Added after the copy, so only the primary has it.
+        created = json.loads(self.client().post('/api/questions', json={
+            'question': 'Is this question deleted?',
+            'answer': 'Yes',
+            'difficulty': 1,
+            'category': 1
+        }).data)['created']
+        response = app.test_client().delete(
+            '/api/questions/{}?include_questions=false'.format(created))
+        data = json.loads(response.data)
+        with self.app.app_context():
+            total_questions = Question.query.count()
+        for engine in app.extensions['replicas'].engines + [replica]:
+            engine.dispose()
+        shutil.rmtree(directory)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['deleted'], created)
+        self.assertEqual(data['total_questions'], total_questions)
+
+    def test_replica_per_session(self):
+        """Tests a session reads from one replica, and from the primary
+        straight after another process changes questions."""
+        directory = tempfile.mkdtemp()
+        replicas = [copy_database(self.app, os.path.join(
+            directory, f'replica{number}.db')) for number in range(2)]
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'SQLALCHEMY_REPLICA_URIS': [str(replica.url)
+                                        for replica in replicas],
+            'RESPONSE_CACHE_BACKEND': LRUBackend()
+        })
+        replica_set = app.extensions['replicas']
+        replica_set.lag_grace = 0
+        select = Question.__table__.select()
+        binds = []
+        for session in range(10):
+            with app.app_context():
+                binds.append({db.session.get_bind(clause=select)
+                              for query in range(10)})
+                db.session.remove()
+        # As written by another worker sharing the content version.
+        replica_set.lag_grace = 60
+        ContentVersion().bump()
+        with app.app_context():
+            after_write = db.session.get_bind(clause=select)
+            db.session.remove()
+        for engine in replica_set.engines + replicas:
+            engine.dispose()
+        shutil.rmtree(directory)
+
+        for bind in binds:
+            self.assertEqual(len(bind), 1)
+            self.assertIn(bind.pop(), replica_set.engines)
+        self.assertNotIn(after_write, replica_set.engines)
+
+    def test_replica_query_retry(self):
+        """Tests a query that fails on a healthy replica is retried on
+        the primary."""
+        directory = tempfile.mkdtemp()
+        # Passes the health check, but has no tables.
+        replica = create_engine(
+            'sqlite:///' + os.path.join(directory, 'replica.db'))
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'SQLALCHEMY_REPLICA_URIS': [str(replica.url)],
+            'RESPONSE_CACHE_BACKEND': LRUBackend()
+        })
+        replica_set = app.extensions['replicas']
+        replica_set.lag_grace = 0
+        # Loads the category cache first, so only the listing's own
+        # queries are counted.
+        app.test_client().get('/api/categories')
+        response = app.test_client().get('/api/questions?page=1')
+        down_until = replica_set.down_until[replica_set.engines[0]]
+        for engine in replica_set.engines + [replica]:
+            engine.dispose()
+        shutil.rmtree(directory)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['questions'])
+        self.assertGreater(down_until, 0)
+
+    def test_replica_fallback(self):
+        """Tests reads fall back to the primary when a replica fails."""
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'SQLALCHEMY_REPLICA_URIS': ['sqlite:////nonexistent/replica.db'],
+            'RESPONSE_CACHE_BACKEND': LRUBackend()
+        })
+        response = app.test_client().get('/api/questions')
+        replica = app.extensions['replicas'].engines[0]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(app.extensions['replicas'].choose(), None)
+        self.assertGreater(app.extensions['replicas'].down_until[replica], 0)
+
     # Tests for get_questions
     def test_get_questions_all(self):
         """Test questions list response with no args."""
@@ -130,6 +560,122 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['current_category'], [])
         self.assertTrue(data['categories'])
 
+    def test_get_questions_pagination_total(self):
+        """Test paginated total matches the unpaginated question count."""
+        all_response = self.client().get('/api/questions')
+        all_data = json.loads(all_response.data)
+        response = self.client().get('/api/questions?page=1')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total_questions'],
+                         all_data['total_questions'])
+        self.assertEqual(data['total_questions'],
+                         len(all_data['questions']))
+        self.assertEqual(data['questions'],
+                         all_data['questions'][:QUESTIONS_PER_PAGE])
+
+    def test_get_questions_cursor_pagination(self):
+        """Test cursor pagination walks every question once."""
+        all_response = self.client().get('/api/questions')
+        all_data = json.loads(all_response.data)
+        question_ids = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client().get(f'/api/questions?after={cursor}')
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['success'], True)
+            self.assertLessEqual(len(data['questions']), QUESTIONS_PER_PAGE)
+            self.assertEqual(data['total_questions'],
+                             all_data['total_questions'])
+            question_ids.extend(
+                [question['id'] for question in data['questions']])
+            cursor = data['next_cursor']
+
+        self.assertEqual(question_ids,
+                         [question['id'] for question
+                          in all_data['questions']])
+
+    def test_get_questions_page_next_cursor(self):
+        """Test a page returns a cursor for the following page."""
+        page_two = json.loads(
+            self.client().get('/api/questions?page=2').data)
+        page_one = json.loads(
+            self.client().get('/api/questions?page=1').data)
+        response = self.client().get(
+            f'/api/questions?after={page_one["next_cursor"]}')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['questions'], page_two['questions'])
+
+    def test_422_get_questions_bad_cursor(self):
+        """Test 422 error on requesting an invalid cursor."""
+        response = self.client().get('/api/questions?after=junk')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_422)
+        self.assertEqual(data['description'], CURSOR_ERR)
+
+    def test_get_questions_modified_after_write(self):
+        """Tests conditional GET of questions returns 200 after a write."""
+        response = self.client().get('/api/questions?page=1')
+        etag = response.headers['ETag']
+        not_modified = self.client().get(
+            '/api/questions?page=1', headers={'If-None-Match': etag})
+        test_question = Question(
+            question='What is the air speed velocity of an unladen swallow?',
+            answer='What do you mean? An African or European swallow?',
+            difficulty=5,
+            category=1
+        )
+        test_question.insert()
+        modified = self.client().get(
+            '/api/questions?page=1', headers={'If-None-Match': etag})
+        test_question.delete()
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified.headers['ETag'], etag)
+        self.assertEqual(json.loads(modified.data)['total_questions'],
+                         json.loads(response.data)['total_questions'] + 1)
+
+    def test_get_questions_cache_invalidation(self):
+        """Tests creating a question only invalidates cached listings
+           for its category, using the shared cache backend."""
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'RESPONSE_CACHE_BACKEND': SharedBackend(MemoryClient())
+        })
+        client = app.test_client
+        first = json.loads(client().get('/api/categories/1/questions').data)
+        client().get('/api/categories/2/questions')
+        backend_values = app.config['RESPONSE_CACHE_BACKEND'].client.values
+        cached_keys = set(backend_values)
+
+        response = client().post('/api/questions', json={
+            'question': 'What is the airspeed velocity of an unladen swallow?',
+            'answer': 'What do you mean? An African or European swallow?',
+            'difficulty': 5,
+            'category': 1
+        })
+        created = json.loads(response.data)['created']
+        second = json.loads(client().get('/api/categories/1/questions').data)
+        client().get('/api/categories/2/questions')
+        client().delete(f'/api/questions/{created}')
+        new_keys = set(backend_values) - cached_keys
+
+        self.assertEqual(second['total_questions'],
+                         first['total_questions'] + 1)
+        self.assertTrue(any('/api/categories/1/' in key
+                            for key in new_keys))
+        self.assertFalse(any('/api/categories/2/' in key
+                             for key in new_keys))
+
     def test_400_questions_bad_request(self):
         """Tests posts requests with unrecognizable data."""
         response = self.client().post('/api/questions', json={
@@ -238,6 +784,52 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(data['total_questions'])
 
+    def test_delete_question_without_questions(self):
+        """Tests delete returns only the count when opting out of the
+           question list."""
+        test_question = Question(
+            question='What is the air speed velocity of an unladen swallow?',
+            answer='What do you mean? An African or European swallow?',
+            difficulty=5,
+            category=1
+        )
+        test_question.insert()
+        test_question_id = test_question.id
+        total_before = json.loads(
+            self.client().get('/api/questions?page=1').data
+        )['total_questions']
+
+        response = self.client().delete(
+            f'/api/questions/{test_question_id}?include_questions=false')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted'], test_question_id)
+        self.assertEqual(data['total_questions'], total_before - 1)
+        self.assertNotIn('questions', data)
+
+    def test_delete_question_page(self):
+        """Tests delete returns the requested page of questions."""
+        test_question = Question(
+            question='What is the air speed velocity of an unladen swallow?',
+            answer='What do you mean? An African or European swallow?',
+            difficulty=5,
+            category=1
+        )
+        test_question.insert()
+        test_question_id = test_question.id
+
+        response = self.client().delete(
+            f'/api/questions/{test_question_id}?page=1')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['deleted'], test_question_id)
+        self.assertTrue(data['questions'])
+        self.assertLessEqual(len(data['questions']), QUESTIONS_PER_PAGE)
+        self.assertTrue(data['total_questions'])
+
     def test_404_delete_question(self):
         """Test delete method for 404 on non-existent question."""
         response = self.client().delete('/api/questions/100000')
@@ -266,6 +858,54 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['created'], new_question.id)
 
+    def test_post_question_created_id(self):
+        """Test the created id is the id of the posted question."""
+        response = self.client().post('/api/questions', json={
+            'question': 'What is your favourite colour?',
+            'answer': 'Blue. No, yel...',
+            'difficulty': 2,
+            'category': 1
+        })
+        data = json.loads(response.data)
+
+        with self.app.app_context():
+            new_question = Question.query.get(data['created'])
+            new_question_text = new_question.question
+            new_question.delete()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(new_question_text, 'What is your favourite colour?')
+
+    def test_post_question_concurrent_ids(self):
+        """Tests questions posted concurrently get distinct ids, each the
+           id of its own question."""
+        def post_question(number):
+            response = self.client().post('/api/questions', json={
+                'question': 'Which concurrent question is this? {}'
+                            .format(number),
+                'answer': str(number),
+                'difficulty': 1,
+                'category': 1
+            })
+            return number, response.status_code, json.loads(response.data)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(post_question, range(16)))
+        created_ids = [data['created'] for number, status_code, data
+                       in results]
+        with self.app.app_context():
+            answers = {question.id: question.answer for question
+                       in Question.query.filter(Question.id.in_(created_ids))}
+            for question in Question.query.filter(
+                    Question.id.in_(created_ids)):
+                question.delete()
+
+        self.assertEqual(len(set(created_ids)), len(results))
+        for number, status_code, data in results:
+            self.assertEqual(status_code, 200)
+            self.assertEqual(answers[data['created']], str(number))
+
     def test_422_post_question_category_not_exist(self):
         """Test 422 for non-existent category."""
         response = self.client().post('/api/questions', json={
@@ -369,6 +1009,128 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], ERROR_422)
         self.assertEqual(data['description'], QUESTION_FIELDS_ERR)
 
+    # Tests for import_questions
+    def test_import_questions(self):
+        """Tests bulk import inserts valid rows and reports row errors."""
+        response = self.client().post('/api/questions/import', json=[
+            {
+                'question': 'What is the capital of Assyria?',
+                'answer': 'Assur',
+                'difficulty': 4,
+                'category': 3
+            },
+            {
+                'question': 'What is the capital of Assyria?',
+                'answer': 'Assur',
+                'difficulty': 6,
+                'category': 3
+            }
+        ])
+        data = json.loads(response.data)
+
+        with self.app.app_context():
+            imported = Question.query.filter(
+                Question.question == 'What is the capital of Assyria?').all()
+            imported_count = len(imported)
+            for question in imported:
+                question.delete()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(imported_count, 1)
+        self.assertEqual(data['error_count'], 1)
+        self.assertEqual(data['errors'][0]['row'], 2)
+        self.assertEqual(data['errors'][0]['description'],
+                         ADD_QUESTION_DIFFICULTY_ERR)
+
+    def test_import_questions_csv(self):
+        """Tests bulk import from a CSV stream."""
+        response = self.client().post(
+            '/api/questions/import',
+            data=('question,answer,difficulty,category\n'
+                  'What is the capital of Assyria?,Assur,4,3\n'),
+            content_type='text/csv')
+        data = json.loads(response.data)
+
+        with self.app.app_context():
+            for question in Question.query.filter(
+                    Question.question == 'What is the capital of Assyria?'):
+                question.delete()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['errors'], [])
+
+    def test_import_questions_csv_encoding(self):
+        """Tests bulk import reports rows that aren't UTF-8."""
+        response = self.client().post(
+            '/api/questions/import',
+            data=(b'question,answer,difficulty,category\n'
+                  b'What is the capital of Assyria?,Ass\xfcr,4,3\n'
+                  b'What is the capital of Assyria?,Assur,4,3\n'),
+            content_type='text/csv')
+        data = json.loads(response.data)
+
+        with self.app.app_context():
+            for question in Question.query.filter(
+                    Question.question == 'What is the capital of Assyria?'):
+                question.delete()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['error_count'], 1)
+        self.assertEqual(data['errors'][0]['row'], 2)
+        self.assertEqual(data['errors'][0]['description'],
+                         IMPORT_ENCODING_ERR)
+
+    def test_400_import_questions_format(self):
+        """Tests bulk import rejects unsupported formats."""
+        response = self.client().post('/api/questions/import',
+                                      data='junk data',
+                                      content_type='text/plain')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_400)
+        self.assertEqual(data['description'], IMPORT_FORMAT_ERR)
+
+    # Tests for export_questions
+    def test_export_questions(self):
+        """Tests export streams every question as NDJSON."""
+        all_data = json.loads(self.client().get('/api/questions').data)
+        response = self.client().get('/api/questions/export')
+        lines = response.data.decode().splitlines()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in lines],
+                         all_data['questions'])
+
+    def test_export_questions_category_gzip(self):
+        """Tests export of a category as gzipped NDJSON."""
+        category_id = 1
+        category_data = json.loads(self.client().get(
+            f'/api/categories/{category_id}/questions').data)
+        response = self.client().get(
+            f'/api/questions/export?category={category_id}&gzip=true')
+        lines = gzip.decompress(response.data).decode().splitlines()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/gzip')
+        self.assertEqual([json.loads(line) for line in lines],
+                         category_data['questions'])
+
+    def test_404_export_questions_category_not_found(self):
+        """Tests export of a category that doesn't exist."""
+        response = self.client().get('/api/questions/export?category=100000')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['description'], CATEGORY_NOT_FOUND)
+
     # Tests for search
     def test_search(self):
         """Tests that search returns valid response."""
@@ -381,6 +1143,76 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(len(data['questions']))
 
+    def test_search_answer(self):
+        """Tests that search matches on answers and ranks results."""
+        test_question = Question(
+            question='Which knight guards the Bridge of Death?',
+            answer='The Bridgekeeper of the Gorge of Eternal Peril',
+            difficulty=3,
+            category=1
+        )
+        test_question.insert()
+        test_question_id = test_question.id
+
+        response = self.client().post('api/questions', json={
+            'search_term': 'eternal peril'
+        })
+        data = json.loads(response.data)
+        test_question.delete()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['id'], test_question_id)
+
+    def test_search_no_results(self):
+        """Tests that a search with no matches returns an empty list."""
+        response = self.client().post('api/questions', json={
+            'search_term': 'unladen swallow airspeed velocity xyzzy'
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['questions'], [])
+        self.assertEqual(data['total_questions'], 0)
+
+    def test_search_pagination(self):
+        """Tests ranked search pages have no cursor, and reject one."""
+        response = self.client().post('api/questions?page=1', json={
+            'search_term': 'the'
+        })
+        cursor_response = self.client().post(
+            'api/questions?after={}'.format(encode_cursor(1)),
+            json={'search_term': 'the'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['questions'])
+        self.assertNotIn('next_cursor', data)
+        self.assertEqual(cursor_response.status_code, 422)
+        self.assertEqual(json.loads(cursor_response.data)['description'],
+                         RANKED_CURSOR_ERR)
+
+    def test_search_number(self):
+        """Tests that a number is searched as text."""
+        response = self.client().post('api/questions', json={
+            'search_term': 1984
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+
+    def test_422_search_term_not_string(self):
+        """Tests 422 for a search term that isn't a string or number."""
+        response = self.client().post('api/questions', json={
+            'search_term': None
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['description'], SEARCH_TERM_ERR)
+
     # Tests for questions by category
     def test_get_questions_by_category_no_args(self):
         """Tests that questions return for valid category with no args."""
@@ -489,6 +1321,434 @@ class TriviaTestCase(unittest.TestCase):
 
             quiz_round += 1
 
+    def test_play_quizz_category_exhausted(self):
+        """Tests quiz ends when all category questions were played."""
+        category_id = 1
+        category_data = json.loads(self.client().get(
+            f'/api/categories/{category_id}/questions').data)
+        question_ids = [question['id'] for question
+                        in category_data['questions']]
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': question_ids[1:],
+            'quiz_category': category_id
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['question']['id'], question_ids[0])
+
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': question_ids,
+            'quiz_category': category_id
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question'], None)
+
+    def test_play_quizz_session(self):
+        """Tests a quiz session serves each category question once."""
+        category_id = 1
+        category_data = json.loads(self.client().get(
+            f'/api/categories/{category_id}/questions').data)
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': category_id,
+            'session': True
+        })
+        data = json.loads(response.data)
+        session_id = data['session_id']
+        question_ids = []
+        """Plays rounds until the session runs out of questions."""
+        while data['question'] is not None:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['success'], True)
+            self.assertEqual(data['session_id'], session_id)
+            self.assertEqual(data['question']['category'], category_id)
+            question_ids.append(data['question']['id'])
+            response = self.client().post('/api/quizzes', json={
+                'session_id': session_id
+            })
+            data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(question_ids),
+                         [question['id'] for question
+                          in category_data['questions']])
+
+        """Verifies the session ends when it runs out of questions."""
+        response = self.client().post('/api/quizzes', json={
+            'session_id': session_id
+        })
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_play_quiz_session_not_found(self):
+        """Test 404 response for an unknown quiz session."""
+        response = self.client().post('/api/quizzes', json={
+            'session_id': 'not a session'
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_404)
+        self.assertEqual(data['description'], QUIZ_SESSION_NOT_FOUND)
+
+    def test_404_play_quiz_session_not_string(self):
+        """Test 404 response for a quiz session id that isn't a string."""
+        response = self.client().post('/api/quizzes', json={
+            'session_id': ['not a session']
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['description'], QUIZ_SESSION_NOT_FOUND)
+
+    def test_play_quizz_previous_ranges(self):
+        """Tests quiz excludes previous questions sent as ranges."""
+        with self.app.app_context():
+            question_ids = sorted(question.id for question in Question.query
+                                  .filter(Question.category == 5))
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': [[0, question_ids[-2]],
+                                   [question_ids[-1] + 1, 1000000]],
+            'quiz_category': 5
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['question']['id'], question_ids[-1])
+
+    def test_422_play_quiz_previous_limit(self):
+        """Test 422 when previous questions has too many items, or an
+        invalid range."""
+        limit_response = self.client().post('/api/quizzes', json={
+            'previous_questions': list(range(PREVIOUS_QUESTIONS_MAX + 1)),
+            'quiz_category': 1
+        })
+        range_response = self.client().post('/api/quizzes', json={
+            'previous_questions': [[5, 1]],
+            'quiz_category': 1
+        })
+
+        self.assertEqual(limit_response.status_code, 422)
+        self.assertEqual(json.loads(limit_response.data)['description'],
+                         PREVIOUS_LIMIT_ERR)
+        self.assertEqual(range_response.status_code, 422)
+        self.assertEqual(json.loads(range_response.data)['description'],
+                         PREVIOUS_LIST_ERR)
+
+    def test_413_play_quiz_request_size(self):
+        """Tests quiz requests over the byte limit get a 413 before the
+        body is parsed."""
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'QUIZ_REQUEST_MAX_BYTES': 1024})
+        # Not valid JSON, so a 413 rather than 400 shows it isn't parsed.
+        body = b'[' * 2048
+        responses = [app.test_client().post(
+            path, data=body, content_type='application/json')
+            for path in ('/api/quizzes', '/api/quizzes/batch')]
+        small_response = app.test_client().post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': 0
+        })
+
+        for response in responses:
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(json.loads(response.data)['description'],
+                             QUIZ_REQUEST_SIZE_ERR.format(1024))
+        self.assertEqual(small_response.status_code, 200)
+
+    def test_play_quizz_batch(self):
+        """Tests quiz batch returns unique questions not asked before."""
+        with self.app.app_context():
+            question_ids = [question.id for question in Question.query
+                            .filter(Question.category == 4)]
+        # Asks for every question not asked before, however many the
+        # database has.
+        response = self.client().post('/api/quizzes/batch', json={
+            'previous_questions': question_ids[:2],
+            'quiz_category': 4,
+            'count': len(question_ids) - 2
+        })
+        data = json.loads(response.data)
+        batch_ids = [question['id'] for question in data['questions']]
+        finished = json.loads(self.client().post('/api/quizzes/batch', json={
+            'previous_questions': question_ids,
+            'quiz_category': 4
+        }).data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(batch_ids), len(question_ids) - 2)
+        self.assertEqual(set(batch_ids), set(question_ids[2:]))
+        self.assertEqual(finished['questions'], [])
+
+    def test_422_play_quizz_batch_count(self):
+        """Tests 422 when a quiz batch asks for too many questions."""
+        response = self.client().post('/api/quizzes/batch', json={
+            'previous_questions': [],
+            'quiz_category': 1,
+            'count': 1000
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['description'], QUIZ_BATCH_COUNT_ERR)
+
+    def test_play_quizz_adaptive(self):
+        """Tests adaptive quiz steps difficulty with answers."""
+        # Adds a question of each difficulty the quiz is expected to
+        # pick, since the fixture may have none.
+        with self.app.app_context():
+            added = [Question('What is the adaptive question?', 'This one',
+                              1, difficulty).insert()
+                     for difficulty in (1, 3)]
+        first = json.loads(self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': [],
+            'quiz_category': 1
+        }).data)
+        harder = json.loads(self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': [first['question']['id']],
+            'quiz_category': 1,
+            'difficulty': 2,
+            'last_answer_correct': True
+        }).data)
+        easier = json.loads(self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': [],
+            'quiz_category': 0,
+            'difficulty': 2,
+            'last_answer_correct': False
+        }).data)
+        with self.app.app_context():
+            for question_id in added:
+                Question.query.get(question_id).delete()
+
+        self.assertEqual(first['success'], True)
+        self.assertEqual(first['difficulty'], 1)
+        self.assertEqual(first['question']['difficulty'], 1)
+        self.assertEqual(first['question']['category'], 1)
+        self.assertEqual(harder['difficulty'], 3)
+        self.assertEqual(harder['question']['difficulty'], 3)
+        self.assertEqual(harder['question']['category'], 1)
+        self.assertEqual(easier['difficulty'], 1)
+        self.assertEqual(easier['question']['difficulty'], 1)
+
+    def test_play_quizz_adaptive_nearest_difficulty(self):
+        """Tests adaptive quiz moves to the nearest difficulty with
+        questions left, and ends when none are left."""
+        with self.app.app_context():
+            hardest = [question.id for question in Question.query.filter(
+                Question.category == 1, Question.difficulty == 5)]
+            every = [question.id for question in Question.query.filter(
+                Question.category == 1)]
+        nearest = json.loads(self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': hardest,
+            'quiz_category': 1,
+            'difficulty': 4,
+            'last_answer_correct': True
+        }).data)
+        finished = json.loads(self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': every,
+            'quiz_category': 1
+        }).data)
+
+        self.assertEqual(nearest['difficulty'], 4)
+        self.assertEqual(nearest['question']['difficulty'], 4)
+        self.assertEqual(finished['success'], True)
+        self.assertEqual(finished['question'], None)
+
+    def test_play_quizz_adaptive_added_question(self):
+        """Tests adaptive quiz picks questions added after the question
+        index is loaded."""
+        self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': [],
+            'quiz_category': 2
+        })
+        with self.app.app_context():
+            hardest = [question.id for question in Question.query.filter(
+                Question.category == 2, Question.difficulty == 5)]
+        created = json.loads(self.client().post('/api/questions', json={
+            'question': 'What is the hardest question?',
+            'answer': 'This one',
+            'difficulty': 5,
+            'category': 2
+        }).data)['created']
+        response = self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': hardest,
+            'quiz_category': 2,
+            'difficulty': 5
+        })
+        data = json.loads(response.data)
+        self.client().delete('/api/questions/{}'.format(created))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['question']['id'], created)
+
+    def test_question_index_snapshot(self):
+        """Tests workers share a question index snapshot file, with
+        their own changes applied over it."""
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'question_index')
+        with self.app.app_context():
+            first_worker = QuestionIndex(path=path)
+            first_worker.setup()
+            built = os.stat(path).st_mtime_ns
+            second_worker = QuestionIndex(path=path)
+            second_worker.setup()
+            mapped = os.stat(path).st_mtime_ns
+            question_ids = {question.id for question in Question.query
+                            .filter(Question.category == 3)}
+            # Uses a difficulty the category has questions of.
+            difficulty = Question.query.get(min(question_ids)).difficulty
+            bucket_ids = {question.id for question in Question.query
+                          .filter(Question.category == 3,
+                                  Question.difficulty == difficulty)}
+            picked = {second_worker.sample(3, None, set())
+                      for attempt in range(200)}
+            second_worker.apply([('add', 3, difficulty, 100000),
+                                 ('remove', 3, difficulty,
+                                  min(question_ids))])
+            available = second_worker.sample(
+                3, difficulty, bucket_ids - {min(question_ids)})
+        shutil.rmtree(directory)
+
+        # The second worker maps the first worker's file.
+        self.assertEqual(mapped, built)
+        self.assertEqual(type(second_worker.buckets[(3, difficulty)]),
+                         memoryview)
+        self.assertTrue(picked <= question_ids)
+        self.assertEqual(available, 100000)
+
+    def test_question_index_previous_ranges(self):
+        """Tests quizzes skip ranges of previous questions without
+        checking each question in them."""
+        index = QuestionIndex(path='')
+        with self.app.app_context():
+            last_id = max(question.id for question in Question.query)
+            index.get()
+            with mock.patch.object(index, 'available',
+                                   wraps=index.available) as available:
+                every = index.sample_many(
+                    0, None, PreviousQuestions(ranges=[[1, 10 ** 12]]), 5)
+                checked_every = available.call_count
+                available.reset_mock()
+                last = index.sample_many(
+                    0, None, PreviousQuestions(ranges=[[1, last_id - 1]]), 5)
+                checked_last = available.call_count
+
+        self.assertEqual(every, [])
+        self.assertEqual(last, [last_id])
+        # Random picks check at most QUIZ_SAMPLE_ATTEMPTS per question
+        # asked for, and the scan only the question left.
+        self.assertLessEqual(checked_every, QUIZ_SAMPLE_ATTEMPTS * 5)
+        self.assertLessEqual(checked_last, QUIZ_SAMPLE_ATTEMPTS * 5 + 1)
+
+    def test_question_index_invalidate(self):
+        """Tests quizzes keep sampling the index while another thread
+        rebuilds it after an invalidation."""
+        index = QuestionIndex(path='')
+        with self.app.app_context():
+            before = index.get()
+            index.invalidate()
+            # Stands in for another thread rebuilding the index.
+            with index.reload_lock:
+                during = index.get()
+                picked = index.sample(0, None, set())
+            after = index.get()
+
+        self.assertIs(during, before)
+        self.assertTrue(picked)
+        self.assertIsNot(after, before)
+        self.assertEqual(after.keys(), before.keys())
+
+    def test_question_index_single_rebuild(self):
+        """Tests workers starting together, and threads in several workers
+        finding the snapshot expired, load questions from the database
+        once."""
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'question_index')
+        workers = [QuestionIndex(path=path) for worker in range(4)]
+
+        def start_worker(worker):
+            with self.app.app_context():
+                worker.setup()
+
+        def play_round(worker):
+            with self.app.app_context():
+                return worker.sample(0, None, set())
+
+        def slow_load():
+            # Gives the other workers time to find the snapshot missing
+            # or stale while it is rebuilt.
+            time.sleep(0.1)
+            return load_buckets()
+
+        with mock.patch('question_index.load_buckets',
+                        side_effect=slow_load) as load:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(start_worker, workers))
+                startup_loads = load.call_count
+                # Expires the snapshot file and every worker's copy.
+                built_at, buckets = read_snapshot(path)
+                write_snapshot(path, {key: array('i', ids) for key, ids
+                                      in buckets.items()},
+                               built_at - workers[0].ttl)
+                for worker in workers:
+                    worker.expires = 0
+                picked = list(executor.map(play_round, workers * 2))
+        shutil.rmtree(directory)
+
+        self.assertEqual(startup_loads, 1)
+        self.assertEqual(load.call_count, 2)
+        self.assertTrue(all(picked))
+
+    def test_422_play_quizz_adaptive(self):
+        """Tests 422 for an unknown quiz mode or difficulty."""
+        mode_response = self.client().post('/api/quizzes', json={
+            'mode': 'harder',
+            'previous_questions': [],
+            'quiz_category': 1
+        })
+        difficulty_response = self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': [],
+            'quiz_category': 1,
+            'difficulty': 6
+        })
+
+        self.assertEqual(mode_response.status_code, 422)
+        self.assertEqual(json.loads(mode_response.data)['description'],
+                         QUIZ_MODE_ERR)
+        self.assertEqual(difficulty_response.status_code, 422)
+        self.assertEqual(json.loads(difficulty_response.data)['description'],
+                         QUIZ_DIFFICULTY_ERR)
+
+    def test_422_play_quizz_adaptive_answer(self):
+        """Tests 422 for a last answer that isn't true or false."""
+        response = self.client().post('/api/quizzes', json={
+            'mode': 'adaptive',
+            'previous_questions': [],
+            'quiz_category': 1,
+            'difficulty': 2,
+            'last_answer_correct': 1
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['description'], QUIZ_ANSWER_ERR)
+
     def test_400_play_quiz_bad_request(self):
         """Tests posts requests with unrecognizable data."""
         response = self.client().post('/api/quizzes', json={
@@ -0,0 +1,88 @@
+""" ---------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------"""
+
+import logging
+import os
+import secrets
+import tempfile
+import time
+from config import CONTENT_VERSION_PATH, CONTENT_VERSION_TTL
+
+logger = logging.getLogger(__name__)
+
+""" ---------------------------------------------------------------------------
+# Content Version
+# --------------------------------------------------------------------------"""
+
+
+# Tracks a version token for questions and categories, which changes on
+# every write and is used as the ETag of read endpoints.
+#
+# The token is kept in the file at CONTENT_VERSION_PATH, so every worker
+# sees writes made by the others. Without a path, or if the file can't be
+# read or written, the token is held in memory and changes every
+# CONTENT_VERSION_TTL seconds, since writes by other processes can't
+# change it.
+class ContentVersion:
+    def __init__(self, path=CONTENT_VERSION_PATH, ttl=CONTENT_VERSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        # Starts from a new token, written by each process as it starts,
+        # so ETags issued before a restart don't match changes made while
+        # the process was down.
+        self.token = secrets.token_hex(8)
+        self.expires = time.monotonic() + self.ttl
+        self.bumped_at = time.time()
+        if self.path:
+            self.write(self.token)
+
+    def current(self):
+        # Returns the current version token.
+        if self.path:
+            try:
+                with open(self.path) as version_file:
+                    token = version_file.read().strip()
+                if token:
+                    return token
+            except OSError:
+                pass
+        if time.monotonic() >= self.expires:
+            self.token = secrets.token_hex(8)
+            self.expires = time.monotonic() + self.ttl
+        return self.token
+
+    def bump(self):
+        # Changes the version token after a write.
+        self.token = secrets.token_hex(8)
+        self.expires = time.monotonic() + self.ttl
+        self.bumped_at = time.time()
+        if self.path:
+            self.write(self.token)
+
+    def changed_at(self):
+        # Returns when the version last changed, from the version file when
+        # it is shared, so other processes' writes are included.
+        if self.path:
+            try:
+                return max(os.stat(self.path).st_mtime, self.bumped_at)
+            except OSError:
+                pass
+        return self.bumped_at
+
+    def write(self, token):
+        # Replaces the version file atomically, so readers never see a
+        # partly written token. Errors are logged rather than raised, and
+        # the token is held in memory instead.
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            descriptor, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(descriptor, 'w') as version_file:
+                version_file.write(token)
+            os.replace(temp_path, self.path)
+        except OSError as error:
+            logger.warning('content version file unavailable, holding '
+                           'the version in memory: %s', error)
+
+
+content_version = ContentVersion()